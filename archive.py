@@ -0,0 +1,86 @@
+import gzip
+import json
+import os
+import shutil
+from collections import OrderedDict
+import instrumentation
+
+
+# Ældre møder i komprimerede segmenter, ét per år (meetings-2021.json.gz). Hvilke
+# møder der hører til hvert segment, står i schedulerens arkivindeks
+# ({segment: {"serials": [...], "first": dato, "last": dato}}), som gemmes sammen med
+# resten af tilstanden. Ved læsning bruges kun møder, indekset kender, så et segment,
+# der er skrevet uden at indekset nåede at blive opdateret, ikke giver dubletter
+class MeetingArchive:
+    # Antal indlæste segmenter, der holdes i hukommelsen, fx mens der bladres i historikken
+    CACHE_SIZE = 4
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._cache = OrderedDict()
+
+    @staticmethod
+    def segment_name(meeting):
+        return str(meeting['date'])[:4]
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"meetings-{name}.json.gz")
+
+    def _read(self, name):
+        path = self._path(name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return []
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] == stamp:
+            self._cache.move_to_end(name)
+            return cached[1]
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            meetings = json.load(file)
+        self._cache[name] = (stamp, meetings)
+        while len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return meetings
+
+    def load(self, name, serials):
+        serials = set(serials)
+        return [meeting for meeting in self._read(name) if meeting['serial'] in serials]
+
+    def write(self, index, meetings):
+        # Læg møderne i deres segmenter (sammen med dem, der allerede ligger der) og
+        # returnér de nye indeksposter for de berørte segmenter
+        by_segment = {}
+        for meeting in meetings:
+            by_segment.setdefault(self.segment_name(meeting), []).append(meeting)
+        os.makedirs(self.directory, exist_ok=True)
+        entries = {}
+        for name, new in by_segment.items():
+            new_serials = {meeting['serial'] for meeting in new}
+            kept = self.load(name, index[name]['serials']) if name in index else []
+            merged = sorted([m for m in kept if m['serial'] not in new_serials] + new, key=lambda m: m['serial'])
+            path = self._path(name)
+            # Skrives til en midlertidig fil og flyttes på plads, så læsere aldrig ser et halvt segment
+            with gzip.open(f"{path}.tmp", 'wt', encoding='utf-8') as file:
+                json.dump(merged, file, ensure_ascii=False, separators=(',', ':'))
+            os.replace(f"{path}.tmp", path)
+            if instrumentation.is_enabled():
+                instrumentation.note(bytes_written=os.path.getsize(path))
+            self._cache.pop(name, None)
+            dates = [str(meeting['date']) for meeting in merged]
+            entries[name] = {"serials": [meeting['serial'] for meeting in merged], "first": min(dates), "last": max(dates)}
+        return entries
+
+    def copy_to(self, other, names):
+        os.makedirs(other.directory, exist_ok=True)
+        for name in names:
+            if os.path.exists(self._path(name)):
+                shutil.copyfile(self._path(name), other._path(name))
+
+    def clear(self):
+        self._cache.clear()
+        if os.path.isdir(self.directory):
+            for file_name in os.listdir(self.directory):
+                if file_name.startswith("meetings-"):
+                    os.remove(os.path.join(self.directory, file_name))
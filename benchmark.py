@@ -0,0 +1,160 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+from config import ARCHIVE_AFTER_DAYS
+from scheduler import InteractiveGroupScheduler
+from storage import JsonStorage
+from utils import import_members_from_file
+
+DEFAULT_SIZES = [100, 1000, 5000, 50000]
+GROUP_SIZES = [3, 4, 5, 6]
+# Fast antal ombytningsforsøg i shuffle_groups. Med et tidsbudget ville tiden blot være budgettet
+SHUFFLE_ITERATIONS = 100000
+
+
+def generate_roster(n, seed=0):
+    # Syntetisk roster. Tilhørsgrupper og virksomheder følger en skæv (Zipf-lignende)
+    # fordeling, så nogle få grupper er store og mange er små, ligesom i virkeligheden
+    rng = random.Random(seed)
+    affiliations = [f"Netværk {i}" for i in range(max(5, n // 40))]
+    affiliation_weights = [1 / (rank + 1) for rank in range(len(affiliations))]
+    companies = [f"Virksomhed {i}" for i in range(max(10, n // 8))]
+    company_weights = [1 / (rank + 1) ** 0.8 for rank in range(len(companies))]
+    industries = ["IT", "Finans", "Industri", "Handel", "Rådgivning", "Offentlig", "Sundhed", "Byggeri"]
+
+    rows = []
+    for i in range(n):
+        groups = set(rng.choices(affiliations, affiliation_weights, k=rng.choice([1, 1, 1, 2, 2, 3])))
+        rows.append({
+            "Navn": f"Deltager {i}",
+            "Gruppe": ", ".join(sorted(groups)) if rng.random() > 0.03 else None,
+            "Email": f"deltager{i}@example.com",
+            "Virksomhed": rng.choices(companies, company_weights)[0],
+            "Stilling": rng.choice(["Direktør", "Leder", "Specialist", "Konsulent"]),
+            "Branche": rng.choice(industries)
+        })
+    return pd.DataFrame(rows)
+
+
+def generate_history(scheduler, meetings, group_size=4, seed=0):
+    # Tilfældige tidligere møder med hele rosteren, et møde om ugen frem til i dag. Er der
+    # flere, end der kan nås inden for ARCHIVE_AFTER_DAYS, rykkes de tættere sammen, så
+    # komprimeringen ikke arkiverer dem, og load_data/save_data måles med hele historikken
+    rng = random.Random(seed)
+    names = [p['name'] for p in scheduler.participants]
+    step = max(1, min(7, (ARCHIVE_AFTER_DAYS - 1) // max(meetings, 1)))
+    start = date.today() - timedelta(days=step * meetings)
+    with scheduler.batch():
+        for m in range(meetings):
+            rng.shuffle(names)
+            groups = [names[i:i + group_size] for i in range(0, len(names), group_size)]
+            scheduler.create_meeting(groups, str(start + timedelta(days=step * m)))
+
+
+def named_file(data, name):
+    file = io.BytesIO(data)
+    file.name = name
+    return file
+
+
+def timed(results, benchmark, participants, func, **extra):
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+    results.append({"benchmark": benchmark, "participants": participants, "seconds": round(seconds, 6), **extra})
+    return value
+
+
+def run_size(n, meetings, results, skip_xlsx_above, seed, shuffle_iterations=SHUFFLE_ITERATIONS):
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = JsonStorage(os.path.join(tmp, "data.json"), os.path.join(tmp, "data.log"))
+        scheduler = InteractiveGroupScheduler(storage=storage)
+        roster = generate_roster(n, seed)
+
+        csv_bytes = roster.to_csv(index=False).encode("utf-8")
+        timed(results, "import_members_from_file[csv]", n,
+              lambda: import_members_from_file(scheduler, named_file(csv_bytes, "roster.csv")), bytes=len(csv_bytes))
+        if n <= skip_xlsx_above:
+            xlsx = io.BytesIO()
+            roster.to_excel(xlsx, index=False)
+            xlsx_bytes = xlsx.getvalue()
+            # Egen scheduler: samme liste i den fyldte scheduler ville blot være en synkronisering uden ændringer
+            xlsx_scheduler = InteractiveGroupScheduler(
+                storage=JsonStorage(os.path.join(tmp, "xlsx.json"), os.path.join(tmp, "xlsx.log")))
+            timed(results, "import_members_from_file[xlsx]", n,
+                  lambda: import_members_from_file(xlsx_scheduler, named_file(xlsx_bytes, "roster.xlsx")), bytes=len(xlsx_bytes))
+
+        generate_history(scheduler, meetings, seed=seed)
+
+        for group_size in GROUP_SIZES:
+            groups, _ = timed(results, f"shuffle_groups[{group_size}]", n, lambda: scheduler.shuffle_groups(
+                group_size, time_budget=None, max_iterations=shuffle_iterations, seed=seed), iterations=shuffle_iterations)
+            results[-1]["score"] = scheduler.last_shuffle_score
+
+        timed(results, "create_meeting", n, lambda: scheduler.create_meeting(groups, str(date.today())))
+        # Redigering af det nye møde: de første medlemmer i de to første grupper bytter plads
+        edited = [list(group) for group in groups]
+        if len(edited) > 1:
+            edited[0][0], edited[1][0] = edited[1][0], edited[0][0]
+        timed(results, "update_meeting_groups", n, lambda: scheduler.update_meeting_groups(len(scheduler.meetings) - 1, edited))
+        timed(results, "save_data", n, scheduler.save_data)
+        results[-1]["bytes"] = os.path.getsize(storage.data_file)
+        timed(results, "load_data", n, lambda: InteractiveGroupScheduler(storage=storage), meetings=len(scheduler.meetings))
+        compact = JsonStorage(os.path.join(tmp, "compact.json"), os.path.join(tmp, "compact.log"), snapshot_format="compact")
+        compact.write_snapshot(scheduler._snapshot_state())
+        timed(results, "load_data[compact]", n, lambda: InteractiveGroupScheduler(storage=compact), meetings=len(scheduler.meetings))
+        frame = timed(results, "export_meetings_to_dataframe", n, scheduler.export_meetings_to_dataframe)
+        results[-1]["rows"] = len(frame)
+        csv_text = timed(results, "export_meeting_to_csv", n, lambda: scheduler.export_meeting_to_csv(scheduler.meetings[-1]))
+        results[-1]["bytes"] = len(csv_text.encode("utf-8"))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark af schedulerens tunge kodestier")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Antal deltagere per kørsel")
+    parser.add_argument("--meetings", type=int, default=20, help="Antal møder i den genererede historik")
+    parser.add_argument("--shuffle-iterations", type=int, default=SHUFFLE_ITERATIONS,
+                        help="Ombytningsforsøg per shuffle_groups-kørsel")
+    parser.add_argument("--skip-xlsx-above", type=int, default=10000, help="Spring XLSX-import over for større rostere")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Skriv JSON-resultatet til denne fil i stedet for stdout")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        run_size(n, args.meetings, results, args.skip_xlsx_above, args.seed, args.shuffle_iterations)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "meetings": args.meetings,
+        "results": results
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import sys
+import time
+from config import DATA_FILE, JOURNAL_FILE, SQLITE_FILE, STORAGE_BACKEND
+
+# Kommandolinje til scheduleren uden Streamlit, fx til cron-jobs og store kørsler:
+#
+#   python cli.py import medlemmer.xlsx
+#   python cli.py plan --group-size 4 --meetings 2 --date 2024-09-01 --create
+#   python cli.py export moeder.parquet
+#   python cli.py export-sheet --sheets-dir ark/
+#
+# Tunge moduler (pandas, streamlit, gsheets) importeres først i de kommandoer, der
+# bruger dem, så en kold start af fx "stats" kun koster scheduleren selv
+
+
+def open_scheduler(args):
+    from scheduler import InteractiveGroupScheduler
+    from storage import JsonStorage, SqliteStorage
+    if args.backend == "sqlite":
+        storage = SqliteStorage(args.sqlite_file)
+    else:
+        storage = JsonStorage(args.data_file, args.journal_file)
+    return InteractiveGroupScheduler(storage=storage)
+
+
+def sheets_connection(args):
+    # Lokale CSV-ark i en mappe, eller Google Sheets via Streamlits secrets
+    if args.sheets_dir:
+        from sheets import LocalSheetsConnection, CachedSheetsReader
+        return CachedSheetsReader(LocalSheetsConnection(args.sheets_dir))
+    return None
+
+
+def command_stats(scheduler, args):
+    print(f"Deltagere: {len(scheduler.participants)}")
+    print(f"Tilhørsgrupper: {len(scheduler.group_affiliations)}")
+    print(f"Møder: {scheduler.count_meetings()} ({scheduler.archived_count} arkiverede)")
+    return True, None
+
+
+def command_import(scheduler, args):
+    from utils import import_members_from_file
+    with open(args.file, 'rb') as file:
+        return import_members_from_file(scheduler, file)
+
+
+def command_sync_sheet(scheduler, args):
+    from utils import update_members_from_sheet
+    return update_members_from_sheet(scheduler, sheets_connection(args), log=print)
+
+
+def command_plan(scheduler, args):
+    from constraints import GroupingConstraints
+    constraints = GroupingConstraints(
+        never_together=[names.split(",") for names in args.never_together],
+        keep_together=[names.split(",") for names in args.keep_together],
+        max_per_company=args.max_per_company,
+        max_per_industry=args.max_per_industry
+    )
+    plan = scheduler.plan_meetings(args.meetings, args.group_size, time_budget=args.time_budget, seed=args.seed,
+                                   constraints=constraints or None)
+    for meeting_index, groups in enumerate(plan, 1):
+        print(f"Møde {meeting_index}:")
+        for group_index, group in enumerate(groups, 1):
+            print(f"  Gruppe {group_index}: {', '.join(group)}")
+    print(f"Score: {scheduler.last_shuffle_score:.1f}")
+    if scheduler.last_constraint_violations and any(scheduler.last_constraint_violations):
+        print("Regelbrud (sammen trods forbud, adskilt trods krav, over grænsen): %d, %d, %d"
+              % scheduler.last_constraint_violations)
+    if not args.create:
+        return True, None
+    if not args.date:
+        return False, "--create kræver --date."
+    with scheduler.batch():
+        names = [scheduler.create_meeting(groups, args.date, meeting_index)
+                 for meeting_index, groups in enumerate(plan, 1)]
+    return True, f"Oprettede {len(names)} møde(r): {', '.join(names)}"
+
+
+def command_export(scheduler, args):
+    from export import export_meetings
+    rows = export_meetings(scheduler, args.path, args.format, start_date=args.start_date, end_date=args.end_date)
+    return True, f"Eksporterede {rows} rækker til {args.path}."
+
+
+def command_export_sheet(scheduler, args):
+    from utils import export_meetings_to_sheets
+    return export_meetings_to_sheets(scheduler, sheets_connection(args), worksheet=args.worksheet)
+
+
+def command_archive(scheduler, args):
+    moved = scheduler.archive_meetings(args.before)
+    return True, f"Arkiverede {moved} møde(r)."
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Gruppeinddeling fra kommandolinjen")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default=STORAGE_BACKEND)
+    parser.add_argument("--data-file", default=DATA_FILE)
+    parser.add_argument("--journal-file", default=JOURNAL_FILE)
+    parser.add_argument("--sqlite-file", default=SQLITE_FILE)
+    parser.add_argument("--timing", action="store_true", help="Mål kaldene og udskriv tiderne til stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("stats", help="Vis antal deltagere og møder").set_defaults(run=command_stats)
+
+    command = commands.add_parser("import", help="Synkronisér medlemmer fra en CSV- eller Excel-fil")
+    command.add_argument("file")
+    command.set_defaults(run=command_import)
+
+    command = commands.add_parser("sync-sheet", help="Synkronisér medlemmer fra medlemsarket")
+    command.add_argument("--sheets-dir", help="Mappe med CSV-ark i stedet for Google Sheets")
+    command.set_defaults(run=command_sync_sheet)
+
+    command = commands.add_parser("plan", help="Foreslå grupper til et eller flere møder")
+    command.add_argument("--group-size", type=int, default=4)
+    command.add_argument("--meetings", type=int, default=1)
+    command.add_argument("--time-budget", type=float, help="Sekunder til optimeringen (standard: 1 per møde)")
+    command.add_argument("--seed", type=int)
+    command.add_argument("--never-together", action="append", default=[], metavar="NAVN,NAVN,...")
+    command.add_argument("--keep-together", action="append", default=[], metavar="NAVN,NAVN,...")
+    command.add_argument("--max-per-company", type=int)
+    command.add_argument("--max-per-industry", type=int)
+    command.add_argument("--date", help="Mødedato (ÅÅÅÅ-MM-DD) til --create")
+    command.add_argument("--create", action="store_true", help="Opret møderne med de foreslåede grupper")
+    command.set_defaults(run=command_plan)
+
+    command = commands.add_parser("export", help="Eksportér mødedata til CSV, Excel eller Parquet")
+    command.add_argument("path")
+    command.add_argument("--format", choices=["csv", "xlsx", "parquet"])
+    command.add_argument("--start-date")
+    command.add_argument("--end-date")
+    command.set_defaults(run=command_export)
+
+    command = commands.add_parser("export-sheet", help="Eksportér nye og ændrede møder til regnearket")
+    command.add_argument("--sheets-dir", help="Mappe med CSV-ark i stedet for Google Sheets")
+    command.add_argument("--worksheet", default="Mødedata")
+    command.set_defaults(run=command_export_sheet)
+
+    command = commands.add_parser("archive", help="Flyt gamle møder til arkivet")
+    command.add_argument("--before", help="Arkivér møder før denne dato (standard: ARCHIVE_AFTER_DAYS dage siden)")
+    command.set_defaults(run=command_archive)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.timing:
+        import instrumentation
+        instrumentation.enable()
+    started = time.perf_counter()
+    scheduler = open_scheduler(args)
+    success, message = args.run(scheduler, args)
+    if message:
+        print(message, file=sys.stdout if success else sys.stderr)
+    if args.timing:
+        for row in instrumentation.summary():
+            print(f"{row['name']}: {row['calls']} kald, {row['seconds']:.3f} s, {row['rows']} rækker, "
+                  f"{row['bytes']} bytes", file=sys.stderr)
+        print(f"I alt: {time.perf_counter() - started:.3f} s", file=sys.stderr)
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,4 +2,37 @@
 
 DATA_FILE = "scheduler_data.json"
 
+# Append-only log med ændringer siden seneste snapshot i DATA_FILE
+JOURNAL_FILE = "scheduler_data.log"
+
+# Når loggen overstiger denne størrelse (bytes), foldes den ind i et nyt snapshot
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+# Hvor scheduler-data gemmes: "json" (DATA_FILE + JOURNAL_FILE) eller "sqlite" (SQLITE_FILE)
+STORAGE_BACKEND = "json"
+SQLITE_FILE = "scheduler_data.sqlite"
+
+# Antal møder per side i mødehistorikken
+MEETINGS_PAGE_SIZE = 10
+
+# Kolonne i medlemsarket, der identificerer et medlem ved synkronisering (fx "Email"
+# eller "Navn"). Rækker uden værdi i kolonnen genkendes på navnet
+MEMBER_KEY_COLUMN = "Email"
+
+# Hvor længe (sekunder) en læsning af et Google Sheets-ark genbruges
+SHEETS_CACHE_TTL = 300
+
+# Snapshot-format for JSON-backenden: "json" (ét læsbart dokument) eller "compact"
+# (orjson, hvis installeret, og mødehistorikken i en separat fil, der først
+# indlæses, når møderne skal bruges)
+SNAPSHOT_FORMAT = "json"
+
+# Møder ældre end dette antal dage flyttes til komprimerede årssegmenter, når loggen
+# foldes ind i et nyt snapshot (eller ved InteractiveGroupScheduler.archive_meetings)
+ARCHIVE_AFTER_DAYS = 365
+
+# Tidsmåling af scheduler- og import/eksport-kald (se instrumentation.py og siden
+# "Diagnostik"). Kan også slås til mens appen kører
+INSTRUMENTATION_ENABLED = False
+
 # Add any other configuration variables here
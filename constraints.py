@@ -0,0 +1,78 @@
+import itertools
+
+# Et brud på en regel vejer langt tungere end sammenfald i tilhørsgruppe og gentagne
+# makkerpar, så reglerne i praksis er hårde, men en umulig kombination giver stadig
+# den bedst mulige inddeling i stedet for en fejl
+CONSTRAINT_WEIGHT = 1000.0
+
+# Deltagerfelter, der kan begrænses til højst N per gruppe
+LIMIT_FIELDS = ('company', 'industry')
+
+
+# Regler for en gruppeinddeling, angivet med deltagernavne:
+#   never_together: mængder af navne, hvor ingen to må komme i samme gruppe
+#   keep_together: mængder af navne, der skal i samme gruppe
+#   max_per_company / max_per_industry: højst så mange fra samme virksomhed/branche per gruppe
+class GroupingConstraints:
+    def __init__(self, never_together=(), keep_together=(), max_per_company=None, max_per_industry=None,
+                 weight=CONSTRAINT_WEIGHT):
+        self.never_together = [set(names) for names in never_together]
+        self.keep_together = [set(names) for names in keep_together]
+        self.limits = {'company': max_per_company, 'industry': max_per_industry}
+        self.weight = weight
+
+    def __bool__(self):
+        return bool(self.never_together or self.keep_together or any(self.limits.values()))
+
+    def compile(self, names, participants):
+        # Oversæt til lokale indekser for grupperingsmotoren. 'participants' følger 'names'
+        local = {name: i for i, name in enumerate(names)}
+        n = len(names)
+        avoid = [set() for _ in range(n)]
+        together = [set() for _ in range(n)]
+        for rule, partners in ((self.never_together, avoid), (self.keep_together, together)):
+            for group in rule:
+                members = [local[name] for name in group if name in local]
+                for i, j in itertools.combinations(members, 2):
+                    partners[i].add(j)
+                    partners[j].add(i)
+
+        limits = []
+        for field in LIMIT_FIELDS:
+            limit = self.limits.get(field)
+            if not limit:
+                continue
+            codes = {}
+            values = [codes.setdefault(p.get(field), len(codes)) if p.get(field) else None for p in participants]
+            limits.append((values, limit))
+
+        return CompiledConstraints([tuple(p) for p in avoid], [tuple(p) for p in together], limits, self.weight)
+
+
+# Reglerne som lokale indekser. Tællerne per gruppe ligger i GroupScorer
+class CompiledConstraints:
+    def __init__(self, avoid, together, limits, weight):
+        self.avoid = avoid
+        self.together = together
+        self.limits = limits
+        self.weight = weight
+
+    def violations(self, groups):
+        # (par sammen, der ikke må være det; par adskilt, der skal være sammen; deltagere over en grænse)
+        assignment = {i: g for g, group in enumerate(groups) for i in group}
+        avoided = sum(1 for i, partners in enumerate(self.avoid) for j in partners
+                      if i < j and assignment.get(i) == assignment.get(j))
+        separated = sum(1 for i, partners in enumerate(self.together) for j in partners
+                        if i < j and assignment.get(i) != assignment.get(j))
+        excess = 0
+        for values, limit in self.limits:
+            for group in groups:
+                counts = {}
+                for i in group:
+                    if values[i] is not None:
+                        counts[values[i]] = counts.get(values[i], 0) + 1
+                excess += sum(max(0, c - limit) for c in counts.values())
+        return avoided, separated, excess
+
+    def cost(self, groups):
+        return self.weight * sum(self.violations(groups))
@@ -0,0 +1,91 @@
+import csv
+import os
+from contextlib import contextmanager
+from instrumentation import timed, note, is_enabled
+
+# Streamende eksport af alle mødedata. Rækkerne hentes i bidder fra
+# InteractiveGroupScheduler.iter_meeting_chunks, så hukommelsesforbruget er det
+# samme uanset historikkens størrelse
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def write_meetings_csv(scheduler, target, chunk_size=DEFAULT_CHUNK_SIZE, **filters):
+    with _open_text(target) as f:
+        writer = csv.DictWriter(f, fieldnames=scheduler.MEETING_EXPORT_COLUMNS)
+        writer.writeheader()
+        rows = 0
+        for chunk in scheduler.iter_meeting_chunks(chunk_size, **filters):
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+
+def write_meetings_xlsx(scheduler, target, chunk_size=DEFAULT_CHUNK_SIZE, **filters):
+    from openpyxl import Workbook
+
+    # write_only-tilstand skriver rækkerne løbende i stedet for at holde hele arket i hukommelsen
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Mødedata")
+    columns = scheduler.MEETING_EXPORT_COLUMNS
+    sheet.append(columns)
+    rows = 0
+    for chunk in scheduler.iter_meeting_chunks(chunk_size, **filters):
+        for row in chunk:
+            sheet.append([row[column] for column in columns])
+        rows += len(chunk)
+    workbook.save(target)
+    return rows
+
+
+def write_meetings_parquet(scheduler, target, chunk_size=DEFAULT_CHUNK_SIZE, **filters):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet-eksport kræver pyarrow (pip install pyarrow).")
+
+    schema = pa.schema([
+        ('Møde-ID', pa.string()),
+        ('Mødenavn', pa.string()),
+        ('Dato', pa.date32()),
+        ('Gruppe', pa.string()),
+        ('Deltager', pa.string()),
+        ('Tilhørsgruppe', pa.string())
+    ])
+    rows = 0
+    with pq.ParquetWriter(target, schema) as writer:
+        for chunk in scheduler.iter_meeting_chunks(chunk_size, **filters):
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+WRITERS = {
+    'csv': write_meetings_csv,
+    'xlsx': write_meetings_xlsx,
+    'parquet': write_meetings_parquet
+}
+
+
+@timed("export.export_meetings")
+def export_meetings(scheduler, path, file_format=None, **options):
+    # Vælg format ud fra filendelsen, hvis det ikke er angivet. Returnerer antal skrevne rækker
+    if file_format is None:
+        file_format = os.path.splitext(str(path))[1].lstrip('.').lower()
+    writer = WRITERS.get(file_format)
+    if writer is None:
+        raise ValueError(f"Ukendt eksportformat: {file_format}. Brug csv, xlsx eller parquet.")
+    rows = writer(scheduler, path, **options)
+    note(rows=rows, bytes_written=os.path.getsize(path) if is_enabled() and not hasattr(path, 'write') else 0)
+    return rows
+
+
+@contextmanager
+def _open_text(target):
+    # Accepterer både en sti og et allerede åbent tekst-objekt
+    if hasattr(target, 'write'):
+        yield target
+    else:
+        with open(target, 'w', newline='', encoding='utf-8') as f:
+            yield f
@@ -0,0 +1,435 @@
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+from participants import affiliation_codes_of, affiliation_mask
+
+# Standardvægte i målfunktionen: et sammenfald i tilhørsgruppe vejer tungere end
+# et gentaget makkerpar
+CONFLICT_WEIGHT = 10.0
+REPEAT_WEIGHT = 1.0
+
+DEFAULT_TIME_BUDGET = 1.0
+DEFAULT_MIN_SIZE = 3
+# Mindste antal sekunder mellem to offentliggjorte mellemresultater fra plan_sequence
+PUBLISH_INTERVAL = 0.25
+
+
+# Alt hvad motoren skal vide om en roster: navne, tilhørsgrupper som heltalskoder
+# (og som bitmasker), og parhistorik som rækker {lokalt indeks: antal}. Kan bygges
+# én gang og genbruges
+class GroupingProblem:
+    def __init__(self, names, affiliations, history, masks=None, constraints=None):
+        self.names = names
+        self.affiliations = affiliations
+        self.history = history
+        self.masks = masks if masks is not None else [affiliation_mask(codes) for codes in affiliations]
+        # Valgfrie regler (CompiledConstraints fra constraints.py)
+        self.constraints = constraints
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_participants(cls, participants, pair_counts=None, constraints=None):
+        # Deltagerposterne har allerede internede koder og masker
+        names = [p['name'] for p in participants]
+        affiliations = [affiliation_codes_of(p) for p in participants]
+        masks = [p.mask if hasattr(p, 'mask') else affiliation_mask(codes) for p, codes in zip(participants, affiliations)]
+        local = {name: i for i, name in enumerate(names)}
+        history = []
+        for name in names:
+            row = pair_counts.row(name) if pair_counts is not None else {}
+            history.append({local[other]: count for other, count in row.items() if other in local})
+        if constraints:
+            constraints = constraints.compile(names, participants)
+        return cls(names, affiliations, history, masks, constraints or None)
+
+
+def group_sizes(n, group_size, min_size=DEFAULT_MIN_SIZE, max_size=None):
+    # Fordel n deltagere i grupper, hvis størrelser højst afviger med én og ligger
+    # inden for [min_size, max_size]
+    if max_size is None:
+        max_size = group_size + 1
+    if n == 0:
+        return []
+    count = max(1, n // group_size)
+    if n % group_size >= min_size:
+        count += 1
+    count = max(count, math.ceil(n / max_size))
+    while count > 1 and n // count < min_size:
+        count -= 1
+    base, extra = divmod(n, count)
+    return [base + 1] * extra + [base] * (count - extra)
+
+
+# Holder tællere per gruppe (tilhørsgrupper og medlemmer), så en ombytning af to
+# deltagere kan vurderes uden at genberegne hele inddelingen. Hver gruppe har også
+# en bitmaske over de tilhørsgrupper, der er repræsenteret, så en deltager uden
+# overlap med gruppen afvises med én bitvis AND
+class GroupScorer:
+    def __init__(self, problem, groups, conflict_weight=CONFLICT_WEIGHT, repeat_weight=REPEAT_WEIGHT):
+        self.problem = problem
+        self.conflict_weight = conflict_weight
+        self.repeat_weight = repeat_weight
+        self.groups = [list(group) for group in groups]
+        self.assignment = {}
+        self.affiliation_counts = []
+        for g, group in enumerate(self.groups):
+            counts = {}
+            for i in group:
+                self.assignment[i] = g
+                for code in problem.affiliations[i]:
+                    counts[code] = counts.get(code, 0) + 1
+            self.affiliation_counts.append(counts)
+        self.group_masks = [affiliation_mask(counts) for counts in self.affiliation_counts]
+        # Med regler: tællere per gruppe for hvert begrænset felt (virksomhed, branche)
+        self.constraints = problem.constraints
+        self.limit_counts = []
+        if self.constraints is not None:
+            for values, _ in self.constraints.limits:
+                per_group = []
+                for group in self.groups:
+                    counts = {}
+                    for i in group:
+                        if values[i] is not None:
+                            _step(counts, values[i], 1)
+                    per_group.append(counts)
+                self.limit_counts.append(per_group)
+        self.cost = self._full_cost()
+
+    def _full_cost(self):
+        conflicts = sum(c * (c - 1) // 2 for counts in self.affiliation_counts for c in counts.values())
+        repeats = 0
+        for group in self.groups:
+            for k, i in enumerate(group):
+                row = self.problem.history[i]
+                repeats += sum(row.get(j, 0) for j in group[k + 1:])
+        cost = self.conflict_weight * conflicts + self.repeat_weight * repeats
+        if self.constraints is not None:
+            cost += self.constraints.cost(self.groups)
+        return cost
+
+    def _contribution(self, i, g, without):
+        # Omkostningen ved at i sidder i gruppe g, når 'without' ikke tælles med
+        if self.problem.masks[i] & self.group_masks[g]:
+            counts = self.affiliation_counts[g]
+            removed = self.problem.affiliations[without]
+            conflicts = sum(counts.get(code, 0) - (code in removed) for code in self.problem.affiliations[i])
+        else:
+            conflicts = 0
+        row = self.problem.history[i]
+        repeats = sum(row.get(j, 0) for j in self.groups[g] if j != without) if row else 0
+        cost = self.conflict_weight * conflicts + self.repeat_weight * repeats
+        if self.constraints is not None:
+            cost += self._constraint_contribution(i, g, without)
+        return cost
+
+    def _constraint_contribution(self, i, g, without):
+        # Prisen afhænger kun af i's egne regelpartnere og gruppens tællere, ikke af
+        # gruppens eller rosterens størrelse. Et par, der holdes sammen, tæller som en
+        # belønning, så forskellen svarer til ændringen i antal adskilte par
+        constraints = self.constraints
+        assignment = self.assignment
+        violations = 0
+        for j in constraints.avoid[i]:
+            if j != without and assignment[j] == g:
+                violations += 1
+        for j in constraints.together[i]:
+            if j != without and assignment[j] == g:
+                violations -= 1
+        for (values, limit), per_group in zip(constraints.limits, self.limit_counts):
+            value = values[i]
+            if value is not None and per_group[g].get(value, 0) - (values[without] == value) >= limit:
+                violations += 1
+        return constraints.weight * violations
+
+    def swap_delta(self, a, b):
+        ga = self.assignment[a]
+        gb = self.assignment[b]
+        if ga == gb:
+            return 0.0
+        return (self._contribution(b, ga, a) + self._contribution(a, gb, b)
+                - self._contribution(a, ga, a) - self._contribution(b, gb, b))
+
+    def swap(self, a, b, delta=None):
+        if delta is None:
+            delta = self.swap_delta(a, b)
+        ga = self.assignment[a]
+        gb = self.assignment[b]
+        group_a = self.groups[ga]
+        group_b = self.groups[gb]
+        group_a[group_a.index(a)] = b
+        group_b[group_b.index(b)] = a
+        self.assignment[a] = gb
+        self.assignment[b] = ga
+        for code in self.problem.affiliations[a]:
+            self._bump(ga, code, -1)
+            self._bump(gb, code, 1)
+        for code in self.problem.affiliations[b]:
+            self._bump(gb, code, -1)
+            self._bump(ga, code, 1)
+        if self.constraints is not None:
+            for (values, _), per_group in zip(self.constraints.limits, self.limit_counts):
+                if values[a] != values[b]:
+                    if values[a] is not None:
+                        _step(per_group[ga], values[a], -1)
+                        _step(per_group[gb], values[a], 1)
+                    if values[b] is not None:
+                        _step(per_group[gb], values[b], -1)
+                        _step(per_group[ga], values[b], 1)
+        self.cost += delta
+
+    def _bump(self, g, code, step):
+        counts = self.affiliation_counts[g]
+        value = counts.get(code, 0) + step
+        if value:
+            counts[code] = value
+            if value == 1:
+                self.group_masks[g] |= 1 << code
+        else:
+            del counts[code]
+            self.group_masks[g] &= ~(1 << code)
+
+
+def _step(counts, key, step):
+    value = counts.get(key, 0) + step
+    if value:
+        counts[key] = value
+    else:
+        del counts[key]
+
+
+def initial_groups(n, sizes, rng):
+    order = list(range(n))
+    rng.shuffle(order)
+    groups = []
+    start = 0
+    for size in sizes:
+        groups.append(order[start:start + size])
+        start += size
+    return groups
+
+
+def optimise_groups(problem, group_size, min_size=DEFAULT_MIN_SIZE, max_size=None, time_budget=DEFAULT_TIME_BUDGET,
+                    max_iterations=None, seed=None, conflict_weight=CONFLICT_WEIGHT, repeat_weight=REPEAT_WEIGHT,
+                    start=None, should_stop=None, on_improvement=None):
+    # Simuleret annealing med ombytninger af to deltagere i forskellige grupper.
+    # Returnerer (grupper som lokale indekser, score), hvor lavere score er bedre.
+    # 'start' er en valgfri eksisterende inddeling, der forbedres i stedet for en tilfældig.
+    # 'should_stop' er en valgfri funktion; returnerer den sand, afbrydes søgningen, og
+    # den bedste inddeling indtil da returneres. 'on_improvement(andel, grupper, score)'
+    # kaldes undervejs (højst hver 256. iteration), når den bedste inddeling er forbedret
+    rng = random.Random(seed)
+    n = len(problem)
+    if start is None:
+        sizes = group_sizes(n, group_size, min_size, max_size)
+        start = initial_groups(n, sizes, rng)
+    else:
+        sizes = [len(group) for group in start]
+    scorer = GroupScorer(problem, start, conflict_weight, repeat_weight)
+    if len(sizes) < 2 or scorer.cost == 0:
+        return scorer.groups, scorer.cost
+
+    if max_iterations is None:
+        max_iterations = 200 * n
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
+
+    # Starttemperatur ud fra størrelsen af tilfældige forværringer
+    samples = [abs(scorer.swap_delta(*_random_pair(scorer, rng))) for _ in range(50)]
+    start_temperature = max(sum(samples) / len(samples), 1e-3)
+    end_temperature = start_temperature * 1e-3
+
+    # Deltagere med krav om at være sammen med nogen. En del af forsøgene flytter en
+    # partner direkte ind i deltagerens gruppe, da tilfældige ombytninger sjældent gør det
+    together = [i for i, partners in enumerate(problem.constraints.together) if partners] if problem.constraints else []
+
+    best_groups = [list(group) for group in scorer.groups]
+    best_cost = scorer.cost
+    published_cost = best_cost
+    progress = 0.0
+    for iteration in range(max_iterations):
+        if iteration % 256 == 0:
+            if should_stop is not None and should_stop():
+                break
+            progress = iteration / max_iterations
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                progress = max(progress, 1 - remaining / time_budget)
+            if on_improvement is not None and best_cost < published_cost:
+                published_cost = best_cost
+                on_improvement(progress, best_groups, best_cost)
+        temperature = start_temperature * (end_temperature / start_temperature) ** progress
+
+        if together and rng.random() < 0.2:
+            a, b = _together_pair(scorer, together, rng)
+        else:
+            a, b = _random_pair(scorer, rng)
+        delta = scorer.swap_delta(a, b)
+        if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+            scorer.swap(a, b, delta)
+            if scorer.cost < best_cost - 1e-9:
+                best_cost = scorer.cost
+                best_groups = [list(group) for group in scorer.groups]
+                if best_cost <= 0:
+                    break
+
+    return best_groups, best_cost
+
+
+def _random_pair(scorer, rng):
+    ga, gb = rng.sample(range(len(scorer.groups)), 2)
+    return rng.choice(scorer.groups[ga]), rng.choice(scorer.groups[gb])
+
+
+def _together_pair(scorer, together, rng):
+    i = rng.choice(together)
+    j = rng.choice(scorer.problem.constraints.together[i])
+    group = scorer.groups[scorer.assignment[i]]
+    if scorer.assignment[j] == scorer.assignment[i] or len(group) < 2:
+        return _random_pair(scorer, rng)
+    b = rng.choice(group)
+    while b == i:
+        b = rng.choice(group)
+    return j, b
+
+
+def add_round(history, groups, sign=1):
+    # Læg et helt mødes par til (eller træk dem fra) parhistorikken på stedet
+    for group in groups:
+        for i in group:
+            row = history[i]
+            for j in group:
+                if i != j:
+                    count = row.get(j, 0) + sign
+                    if count:
+                        row[j] = count
+                    else:
+                        row.pop(j, None)
+
+
+def plan_sequence(problem, number_of_meetings, group_size, min_size=DEFAULT_MIN_SIZE, max_size=None,
+                  time_budget=None, seed=None, passes=1, conflict_weight=CONFLICT_WEIGHT, repeat_weight=REPEAT_WEIGHT,
+                  should_stop=None, on_progress=None):
+    # Planlæg flere møder samlet (som i "social golfer"-problemet): hvert møde
+    # optimeres mod den gemte historik plus de øvrige møder i sekvensen. Efter den
+    # første runde forbedres hvert møde igen med de andre møder fastholdt.
+    # on_progress(andel, plan, score) kaldes efter hver runde og undervejs i den, når
+    # mødet, der optimeres, har fået en bedre inddeling (højst hvert PUBLISH_INTERVAL
+    # sekund); plan og score er None, indtil alle møder har fået en inddeling. Stoppes planlægningen via 'should_stop',
+    # får de resterende møder blot en startinddeling, så planen altid er komplet
+    rng = random.Random(seed)
+    history = [dict(row) for row in problem.history]
+    working = GroupingProblem(problem.names, problem.affiliations, history, problem.masks, problem.constraints)
+    rounds = number_of_meetings * (1 + passes)
+    if time_budget is None:
+        time_budget = DEFAULT_TIME_BUDGET * number_of_meetings
+    round_budget = time_budget / rounds
+    options = dict(min_size=min_size, max_size=max_size, time_budget=round_budget,
+                   conflict_weight=conflict_weight, repeat_weight=repeat_weight)
+
+    plan = []
+    published = time.monotonic()
+
+    def publish_best(done, index):
+        # Mellemresultat for mødet 'index' med de øvrige møder i planen, som de er nu
+        if on_progress is None:
+            return None
+
+        def on_improvement(progress, groups, cost):
+            nonlocal published
+            now = time.monotonic()
+            if now - published < PUBLISH_INTERVAL:
+                return
+            published = now
+            candidate = plan[:index] + [groups] + plan[index + 1:]
+            complete = len(candidate) == number_of_meetings
+            on_progress((done + progress) / rounds, candidate if complete else None,
+                        plan_score(problem, candidate, conflict_weight, repeat_weight) if complete else None)
+        return on_improvement
+
+    for index in range(number_of_meetings):
+        groups, _ = optimise_groups(working, group_size, seed=rng.random(), should_stop=should_stop,
+                                    on_improvement=publish_best(index, index), **options)
+        add_round(history, groups)
+        plan.append(groups)
+        if on_progress is not None:
+            complete = len(plan) == number_of_meetings
+            on_progress(len(plan) / rounds, plan if complete else None,
+                        plan_score(problem, plan, conflict_weight, repeat_weight) if complete else None)
+
+    for round_number in range(passes):
+        for index, groups in enumerate(plan):
+            if should_stop is not None and should_stop():
+                break
+            add_round(history, groups, -1)
+            done = number_of_meetings * (1 + round_number) + index
+            improved, _ = optimise_groups(working, group_size, seed=rng.random(), start=groups, should_stop=should_stop,
+                                          on_improvement=publish_best(done, index), **options)
+            add_round(history, improved)
+            plan[index] = improved
+            if on_progress is not None:
+                on_progress((done + 1) / rounds, plan, plan_score(problem, plan, conflict_weight, repeat_weight))
+
+    return plan, plan_score(problem, plan, conflict_weight, repeat_weight)
+
+
+def plan_score(problem, plan, conflict_weight=CONFLICT_WEIGHT, repeat_weight=REPEAT_WEIGHT):
+    # Samlet score: hvert møde vurderet mod historikken og alle tidligere møder i planen
+    history = [dict(row) for row in problem.history]
+    working = GroupingProblem(problem.names, problem.affiliations, history, problem.masks, problem.constraints)
+    score = 0.0
+    for groups in plan:
+        score += GroupScorer(working, groups, conflict_weight, repeat_weight).cost
+        add_round(history, groups)
+    return score
+
+
+# Rosteren og parhistorikken sendes til hver arbejdsproces én gang via
+# initializer, så de enkelte opgaver kun skal have et seed med
+_worker_problem = None
+
+
+def _init_worker(problem):
+    global _worker_problem
+    _worker_problem = problem
+
+
+def _run_seed(seed, group_size, options):
+    groups, score = optimise_groups(_worker_problem, group_size, seed=seed, **options)
+    return seed, groups, score
+
+
+def optimise_groups_parallel(problem, group_size, workers=None, seeds=None, runs=None, time_budget=DEFAULT_TIME_BUDGET,
+                             **options):
+    # Kør mange uafhængigt seedede optimeringer på en procespulje og returnér den
+    # bedste (grupper, score, seed). time_budget er den samlede væg-tid for alle kørsler
+    workers = workers or os.cpu_count() or 1
+    if seeds is None:
+        seeds = [random.randrange(2 ** 32) for _ in range(runs or workers)]
+    seeds = list(seeds)
+    # Kørslerne afvikles i "bølger" á 'workers' stk., og hver bølge får sin del af budgettet
+    waves = math.ceil(len(seeds) / workers)
+    options = dict(options, time_budget=time_budget / waves if time_budget is not None else None)
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
+
+    best = None
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(problem,)) as pool:
+        futures = [pool.submit(_run_seed, seed, group_size, options) for seed in seeds]
+        # Lidt ekstra tid til opstart af processerne, før ufærdige kørsler opgives
+        timeout = deadline - time.monotonic() + 1.0 if deadline is not None else None
+        done, pending = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+        for future in done:
+            seed, groups, score = future.result()
+            if best is None or score < best[2]:
+                best = (groups, score, seed)
+    if best is None:
+        # Ingen kørsel nåede at blive færdig inden for budgettet
+        groups, score = optimise_groups(problem, group_size, seed=seeds[0], **options)
+        best = (groups, score, seeds[0])
+    return best
@@ -0,0 +1,209 @@
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import INSTRUMENTATION_ENABLED
+
+# Let tidsmåling af kald: antal, varighed, behandlede rækker og skrevne bytes per navn,
+# plus de seneste kald til diagnosesiden. Hvert kald logges også som én JSON-linje på
+# loggeren "gruppeinddeling.timing". Når målingen er slået fra, koster en indpakket
+# funktion kun opslaget af et flag
+logger = logging.getLogger("gruppeinddeling.timing")
+
+# Antal kald, der huskes til visning af de seneste tider
+RECENT_CALLS = 200
+
+_enabled = INSTRUMENTATION_ENABLED
+_lock = threading.Lock()
+_totals = {}
+_recent = deque(maxlen=RECENT_CALLS)
+# Importtider måles altid (det sker kun én gang per proces), så de kan vises, selvom
+# målingen først slås til senere
+_imports = {}
+# Igangværende målte kald per tråd, så note() kan tilskrive rækker og bytes det inderste
+_local = threading.local()
+
+
+def enable(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _totals.clear()
+        _recent.clear()
+
+
+class _Call:
+    __slots__ = ('name', 'started', 'rows', 'bytes')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.bytes = 0
+
+
+def note(rows=0, bytes_written=0):
+    # Tilskriv rækker og/eller skrevne bytes til det inderste igangværende kald
+    if not _enabled:
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        stack[-1].rows += rows
+        stack[-1].bytes += bytes_written
+
+
+def _push(name):
+    call = _Call(name)
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(call)
+    return call
+
+
+def _pop(call, error=None):
+    stack = _local.stack
+    if stack and stack[-1] is call:
+        stack.pop()
+    _record(call.name, time.perf_counter() - call.started, call.rows, call.bytes, error)
+
+
+def _record(name, seconds, rows=0, bytes_written=0, error=None):
+    event = {
+        'name': name,
+        'seconds': round(seconds, 6),
+        'rows': rows,
+        'bytes': bytes_written,
+        'error': error,
+        'at': time.time(),
+        'thread': threading.current_thread().name
+    }
+    with _lock:
+        totals = _totals.get(name)
+        if totals is None:
+            totals = _totals[name] = {'name': name, 'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                      'rows': 0, 'bytes': 0}
+        totals['calls'] += 1
+        totals['errors'] += error is not None
+        totals['seconds'] += seconds
+        totals['max_seconds'] = max(totals['max_seconds'], seconds)
+        totals['rows'] += rows
+        totals['bytes'] += bytes_written
+        _recent.append(event)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(event, ensure_ascii=False))
+
+
+def record_import(name, seconds):
+    # Kun første (kolde) import huskes; senere importer af samme modul er gratis
+    if name not in _imports:
+        _imports[name] = seconds
+        if _enabled:
+            _record(f"import.{name}", seconds)
+
+
+def imports():
+    return dict(_imports)
+
+
+@contextmanager
+def section(name):
+    # Mål en blok kode, fx en importsektion eller rendering af en side
+    if not _enabled:
+        yield
+        return
+    call = _push(name)
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _pop(call, error)
+
+
+def timed(name=None):
+    # Dekorator. Generatorer måles fra første til sidste element, og hvert element
+    # tæller som en række. Returnerer en funktion en DataFrame, tæller dens rækker
+    def decorate(func):
+        label = name or func.__qualname__
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return (yield from func(*args, **kwargs))
+                # Ikke på stakken: generatoren kan blive sat på pause midt i et andet kald
+                started = time.perf_counter()
+                rows = 0
+                error = None
+                try:
+                    for item in func(*args, **kwargs):
+                        rows += 1
+                        yield item
+                except BaseException as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    _record(label, time.perf_counter() - started, rows, 0, error)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            call = _push(label)
+            error = None
+            try:
+                result = func(*args, **kwargs)
+                shape = getattr(result, 'shape', None)
+                if not call.rows and isinstance(shape, tuple) and shape:
+                    call.rows = shape[0]
+                return result
+            except BaseException as e:
+                error = type(e).__name__
+                raise
+            finally:
+                _pop(call, error)
+        return wrapper
+    return decorate
+
+
+def instrument_methods(prefix, exclude=()):
+    # Klassedekorator: mål alle offentlige metoder undtagen 'exclude'. Egenskaber og
+    # contextmanagers (fx batch) lades urørt
+    def decorate(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith('_') or attr in exclude or not inspect.isfunction(value):
+                continue
+            if inspect.isgeneratorfunction(getattr(value, '__wrapped__', None)):
+                continue
+            setattr(cls, attr, timed(f"{prefix}.{attr}")(value))
+        return cls
+    return decorate
+
+
+def summary():
+    # Samlede tal per navn, dyreste først
+    with _lock:
+        rows = [dict(totals) for totals in _totals.values()]
+    for row in rows:
+        row['mean_seconds'] = row['seconds'] / row['calls'] if row['calls'] else 0.0
+    return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+
+def recent(limit=RECENT_CALLS):
+    with _lock:
+        return list(_recent)[-limit:][::-1]
@@ -0,0 +1,83 @@
+import threading
+import time
+
+
+# Et grupperingsforslag, der beregnes i en baggrundstråd, så Streamlit-scriptet ikke
+# blokerer. 'run' kaldes som run(should_stop, publish) og returnerer
+# (plan, score, regelbrud). Undervejs kalder den publish(andel, plan, score) med det
+# bedste resultat indtil nu, som UI'et kan vise og samle op ved næste rerun.
+# cancel() beder jobbet stoppe; det afslutter da med det bedste resultat, det har
+class GroupingJob:
+    def __init__(self, run, time_budget=None):
+        self.time_budget = time_budget
+        self.state = 'running'
+        self.progress = 0.0
+        self.plan = None
+        self.score = None
+        self.violations = None
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+        self._run = run
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._main, name="grouping-job", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _main(self):
+        try:
+            plan, score, violations = self._run(self._stop.is_set, self._publish)
+        except Exception as error:
+            with self._lock:
+                self.state = 'failed'
+                self.error = error
+                self.finished = time.monotonic()
+            return
+        with self._lock:
+            self.plan = plan
+            self.score = score
+            self.violations = violations
+            self.progress = 1.0
+            self.state = 'cancelled' if self._stop.is_set() else 'done'
+            self.finished = time.monotonic()
+
+    def _publish(self, progress, plan=None, score=None):
+        with self._lock:
+            self.progress = progress
+            if plan is not None:
+                self.plan = plan
+                self.score = score
+
+    def cancel(self):
+        self._stop.set()
+
+    @property
+    def done(self):
+        return self.state != 'running'
+
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def status(self):
+        # Et konsistent øjebliksbillede til visning. Fremskridtet følger både de
+        # færdige runder og den brugte del af tidsbudgettet
+        with self._lock:
+            progress = self.progress
+            if not self.done and self.time_budget:
+                progress = max(progress, min(self.elapsed() / self.time_budget, 0.99))
+            return {
+                'state': self.state,
+                'progress': progress,
+                'plan': self.plan,
+                'score': self.score,
+                'violations': self.violations,
+                'error': self.error,
+                'elapsed': self.elapsed()
+            }
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+        return self.done
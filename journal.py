@@ -0,0 +1,82 @@
+import json
+import os
+import instrumentation
+
+# orjson er valgfri: den bruges til det kompakte snapshot-format, når den er installeret
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def write_snapshot(path, data, compact=False):
+    # Skriv til en midlertidig fil og byt den ind atomisk, så et nedbrud midt i
+    # skrivningen aldrig efterlader et halvt snapshot
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb' if compact else 'w') as f:
+        if compact:
+            f.write(dumps(data))
+        else:
+            json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+        written = f.tell()
+    os.replace(tmp_path, path)
+    instrumentation.note(bytes_written=written)
+
+
+def read_snapshot(path):
+    # Begge formater er JSON, så den hurtigste tilgængelige parser kan læse dem
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+# Append-only log med én JSON-post per linje ved siden af snapshot-filen
+class Journal:
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, lines):
+        if not lines:
+            return
+        text = ''.join(line + '\n' for line in lines)
+        with open(self.path, 'a') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        instrumentation.note(bytes_written=len(text.encode("utf-8")))
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # Sidste linje blev kun delvist skrevet før et nedbrud
+                    break
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    break
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def truncate(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,77 @@
+import threading
+from contextlib import contextmanager
+
+# fcntl findes kun på Unix. Uden den er der ingen låsning mellem processer
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Mange samtidige læsere eller én skriver. Tråden, der skriver, må tage låsen igen,
+# både som skriver og som læser. En læser må ikke bede om skrivelåsen
+class ReadWriteLock:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self._cond:
+            owner = self._writer == me
+            if not owner:
+                while self._writer is not None:
+                    self._cond.wait()
+                self._readers += 1
+        try:
+            yield
+        finally:
+            if not owner:
+                with self._cond:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+# Eksklusiv lås på en fil, så kun én proces ad gangen skriver til datafilerne.
+# Kan tages flere gange af samme ejer; kun den yderste tager og slipper selve låsen
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._depth = 0
+
+    def __enter__(self):
+        if not self._depth and fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if not self._depth and self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
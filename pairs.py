@@ -0,0 +1,186 @@
+import numpy as np
+from collections import defaultdict
+
+# Op til dette antal deltagere holdes tællingerne i en tæt NumPy-matrix.
+# Derover skiftes til en sparse repræsentation (række -> {kolonne: antal})
+DENSE_LIMIT = 2000
+
+
+# Hvor mange gange hvert par af deltagere har været i gruppe sammen.
+# Deltagere internes som heltals-id'er (0, 1, 2, ...) efter navn, så opslag og
+# opdateringer sker på indekser frem for navnesøgning
+class PairCounts:
+    def __init__(self, dense_limit=DENSE_LIMIT):
+        self.dense_limit = dense_limit
+        self.names = []
+        self.ids = {}
+        self._dense = np.zeros((0, 0), dtype=np.int32)
+        self._sparse = None
+
+    @property
+    def is_dense(self):
+        return self._sparse is None
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        pid = self.ids.get(name)
+        if pid is None:
+            pid = len(self.names)
+            self.names.append(name)
+            self.ids[name] = pid
+            self._grow(pid + 1)
+        return pid
+
+    def _grow(self, size):
+        if self._sparse is not None:
+            return
+        if size > self.dense_limit:
+            self._to_sparse()
+        elif size > self._dense.shape[0]:
+            capacity = max(size, 2 * self._dense.shape[0], 16)
+            dense = np.zeros((capacity, capacity), dtype=np.int32)
+            n = self._dense.shape[0]
+            dense[:n, :n] = self._dense
+            self._dense = dense
+
+    def _to_sparse(self):
+        sparse = defaultdict(dict)
+        rows, cols = np.nonzero(self._dense)
+        for i, j, count in zip(rows.tolist(), cols.tolist(), self._dense[rows, cols].tolist()):
+            sparse[i][j] = count
+        self._sparse = sparse
+        self._dense = None
+
+    def add_groups(self, groups, sign=1):
+        # Tilføj (eller med sign=-1 fjern) alle par fra et helt møde på én gang
+        groups = [[self.intern(name) for name in group] for group in groups]
+        if self._sparse is None:
+            rows = [i for group in groups for i in group for _ in group]
+            cols = [j for group in groups for _ in group for j in group]
+            if rows:
+                rows = np.asarray(rows)
+                cols = np.asarray(cols)
+                off_diagonal = rows != cols
+                np.add.at(self._dense, (rows[off_diagonal], cols[off_diagonal]), sign)
+        else:
+            for group in groups:
+                for i in group:
+                    row = self._sparse[i]
+                    for j in group:
+                        if i != j:
+                            count = row.get(j, 0) + sign
+                            if count:
+                                row[j] = count
+                            else:
+                                row.pop(j, None)
+
+    def add_pairs(self, pairs, sign=1):
+        # Tilføj (eller fjern) enkelte par (navn_a, navn_b) symmetrisk
+        if not pairs:
+            return
+        rows = [self.intern(a) for a, _ in pairs]
+        cols = [self.intern(b) for _, b in pairs]
+        if self._sparse is None:
+            rows = np.asarray(rows)
+            cols = np.asarray(cols)
+            np.add.at(self._dense, (rows, cols), sign)
+            np.add.at(self._dense, (cols, rows), sign)
+        else:
+            for i, j in zip(rows, cols):
+                for row, col in ((i, j), (j, i)):
+                    count = self._sparse[row].get(col, 0) + sign
+                    if count:
+                        self._sparse[row][col] = count
+                    else:
+                        self._sparse[row].pop(col, None)
+
+    def get(self, a, b):
+        i = self.ids.get(a)
+        j = self.ids.get(b)
+        if i is None or j is None:
+            return 0
+        if self._sparse is None:
+            return int(self._dense[i, j])
+        return self._sparse.get(i, {}).get(j, 0)
+
+    def row(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            return {}
+        if self._sparse is None:
+            values = self._dense[i, :len(self.names)]
+            nonzero = np.nonzero(values)[0]
+            return {self.names[j]: int(values[j]) for j in nonzero.tolist()}
+        return {self.names[j]: count for j, count in self._sparse.get(i, {}).items()}
+
+    def submatrix(self, names):
+        # Tæt matrix for netop de givne deltagere, fx til grupperingsmotoren
+        n = len(names)
+        ids = [self.ids.get(name, -1) for name in names]
+        if self._sparse is None:
+            known = np.asarray([k for k, pid in enumerate(ids) if pid >= 0], dtype=np.intp)
+            matrix = np.zeros((n, n), dtype=np.int32)
+            if len(known):
+                pids = np.asarray(ids, dtype=np.intp)[known]
+                matrix[np.ix_(known, known)] = self._dense[np.ix_(pids, pids)]
+            return matrix
+        matrix = np.zeros((n, n), dtype=np.int32)
+        position = {pid: k for k, pid in enumerate(ids) if pid >= 0}
+        for pid, k in position.items():
+            for j, count in self._sparse.get(pid, {}).items():
+                other = position.get(j)
+                if other is not None:
+                    matrix[k, other] = count
+        return matrix
+
+    def pairs(self):
+        # (a, b, antal) for hvert par med a < b i intern rækkefølge
+        if self._sparse is None:
+            n = len(self.names)
+            rows, cols = np.nonzero(np.triu(self._dense[:n, :n], 1))
+            counts = self._dense[rows, cols]
+            return list(zip(rows.tolist(), cols.tolist(), counts.tolist()))
+        return [(i, j, count) for i, row in self._sparse.items() for j, count in row.items() if i < j]
+
+    def clear(self):
+        self.__init__(self.dense_limit)
+
+    def to_dict(self):
+        return {"names": list(self.names), "pairs": [list(p) for p in self.pairs()]}
+
+    @classmethod
+    def from_dict(cls, data, dense_limit=DENSE_LIMIT):
+        # Parrene kan være gemt som [a, b, antal]-lister ("pairs") eller som tre
+        # kolonner ("columns"), der er hurtigere at læse
+        pair_counts = cls(dense_limit)
+        for name in data.get("names", []):
+            pair_counts.intern(name)
+        if "columns" in data:
+            rows, cols, counts = data["columns"]
+        else:
+            pairs = np.asarray(data.get("pairs", []), dtype=np.int64).reshape(-1, 3)
+            rows, cols, counts = pairs[:, 0], pairs[:, 1], pairs[:, 2]
+        pair_counts._set_pairs(rows, cols, counts)
+        return pair_counts
+
+    def _set_pairs(self, rows, cols, counts):
+        if not len(counts):
+            return
+        rows = np.asarray(rows, dtype=np.intp)
+        cols = np.asarray(cols, dtype=np.intp)
+        counts = np.asarray(counts, dtype=np.int32)
+        if self._sparse is None:
+            self._dense[rows, cols] = counts
+            self._dense[cols, rows] = counts
+            return
+        # Begge retninger sorteret efter række, så hver række kan bygges som ét dict
+        all_rows = np.concatenate([rows, cols])
+        order = np.argsort(all_rows, kind='stable')
+        all_rows = all_rows[order]
+        all_cols = np.concatenate([cols, rows])[order].tolist()
+        all_counts = np.concatenate([counts, counts])[order].tolist()
+        starts = np.flatnonzero(np.r_[True, all_rows[1:] != all_rows[:-1]]).tolist() + [len(all_rows)]
+        for start, end in zip(starts, starts[1:]):
+            self._sparse[int(all_rows[start])] = dict(zip(all_cols[start:end], all_counts[start:end]))
@@ -0,0 +1,128 @@
+import sys
+from collections.abc import MutableMapping
+
+DEFAULT_AFFILIATION = 'Ikke tildelt'
+FIELDS = ('id', 'name', 'groups', 'email', 'company', 'position', 'industry')
+_FIELD_SET = frozenset(FIELDS)
+_MISSING = object()
+
+
+# Tilhørsgrupper internes én gang per proces: hvert navn får en heltalskode og en bit,
+# så en deltagers grupper kan holdes som en bitmaske, og overlap er en bitvis AND
+class AffiliationCodes:
+    def __init__(self):
+        self.names = []
+        self.codes = {}
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self.names.append(sys.intern(name))
+            self.codes[self.names[code]] = code
+        return code
+
+    def intern(self, name):
+        return self.names[self.code(name)]
+
+    def encode(self, groups):
+        return tuple(sorted({self.code(g if isinstance(g, str) else str(g)) for g in groups}))
+
+
+affiliation_codes = AffiliationCodes()
+
+
+def affiliation_mask(codes):
+    mask = 0
+    for code in codes:
+        mask |= 1 << code
+    return mask
+
+
+def affiliation_codes_of(participant):
+    # Koder for en deltagers tilhørsgrupper; manglende 'groups' tæller som 'Ikke tildelt'
+    if isinstance(participant, Participant):
+        return participant.codes
+    return affiliation_codes.encode(participant.get('groups', [DEFAULT_AFFILIATION]))
+
+
+# Kompakt deltagerpost med faste felter i __slots__ og internede tilhørsgrupper.
+# Opfører sig som en dict (p['name'], p.get('email', ...), dict(p)), så eksisterende
+# kode og eksporter virker uændret. Ukendte nøgler gemmes i 'extra'
+class Participant(MutableMapping):
+    __slots__ = FIELDS + ('extra', 'codes', 'mask')
+
+    def __init__(self, data=(), **kwargs):
+        for field in FIELDS:
+            object.__setattr__(self, field, _MISSING)
+        self.extra = None
+        self._set_codes()
+        self.update(data, **kwargs)
+
+    @classmethod
+    def from_dict(cls, data):
+        return data if isinstance(data, cls) else cls(data)
+
+    def _set_codes(self):
+        groups = self.groups if self.groups is not _MISSING else [DEFAULT_AFFILIATION]
+        self.codes = affiliation_codes.encode(groups)
+        self.mask = affiliation_mask(self.codes)
+
+    def get(self, key, default=None):
+        # Hurtigere end MutableMapping.get, som går via en KeyError
+        if key in _FIELD_SET:
+            value = object.__getattribute__(self, key)
+            return default if value is _MISSING else value
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            value = object.__getattribute__(self, key)
+            if value is not _MISSING:
+                return value
+        elif self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            if key == 'groups' and isinstance(value, list):
+                value = [affiliation_codes.intern(g) if isinstance(g, str) else g for g in value]
+            object.__setattr__(self, key, value)
+            if key == 'groups':
+                self._set_codes()
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _FIELD_SET and object.__getattribute__(self, key) is not _MISSING:
+            object.__setattr__(self, key, _MISSING)
+            if key == 'groups':
+                self._set_codes()
+        elif self.extra and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for field in FIELDS:
+            if object.__getattribute__(self, field) is not _MISSING:
+                yield field
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return object.__getattribute__(self, key) is not _MISSING
+        return bool(self.extra) and key in self.extra
+
+    def __repr__(self):
+        return f"Participant({dict(self)!r})"
+
+    def copy(self):
+        return dict(self)
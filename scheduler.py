@@ -1,172 +1,653 @@
-import random
 import json
-import os
-from datetime import datetime
-import pandas as pd
+from datetime import datetime, date, timedelta
 import csv
 import io
-from config import DATA_FILE
+from storage import create_storage
+from pairs import PairCounts
+from stats import MeetingStats
+from grouping import GroupingProblem, optimise_groups, optimise_groups_parallel, plan_sequence, DEFAULT_MIN_SIZE, DEFAULT_TIME_BUDGET
 import uuid
-from collections import defaultdict
+import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+from locking import ReadWriteLock
+from participants import Participant
+from jobs import GroupingJob
+from config import ARCHIVE_AFTER_DAYS
+from instrumentation import instrument_methods
 
+# Billige opslag, der kaldes for hver deltager eller gruppe under rendering, måles ikke
+@instrument_methods("scheduler", exclude=('get_participant_by_name', 'get_participant_by_id', 'is_archived',
+                                          'meeting_fingerprint', 'format_group'))
 class InteractiveGroupScheduler:
-    def __init__(self):
+    def __init__(self, storage=None):
+        self.last_shuffle_score = None
+        self.last_constraint_violations = None
+        # (fingerprint af medlemsarket, revision) ved seneste synkronisering fra Google Sheets
+        self.last_member_sync = None
+        self.storage = storage if storage is not None else create_storage()
+        self._batch_depth = 0
+        self._batch_dirty = False
+        self._pending_records = []
+        self._replaying = False
+        # Instansen kan deles af flere Streamlit-sessioner (tråde): ændringer tager
+        # skrivelåsen, tungere læsninger læselåsen. Låsen på storage beskytter mod
+        # andre processer, og _storage_version afslører, om en anden proces har skrevet
+        self._lock = ReadWriteLock()
+        self._render_lock = threading.Lock()
+        self._storage_version = None
+        # Versioner til at afgøre, om cachet visning af et møde stadig er gyldig
+        self._revisions = itertools.count(1)
+        self._participant_revisions = {}
+        self._meeting_versions = {}
+        self._roster_generation = 0
+        self._render_cache = OrderedDict()
+        self._reset_state()
+        with self._writing():
+            self.load_data()
+
+    def _reset_state(self):
         self.participants = []
-        self.meetings = []
+        self._meetings = []
+        self._meetings_loader = None
         self.group_affiliations = set()
         self.last_meeting_serial = 0
         self.group_history = {}
-        self.load_data()
+        # Hvilken version (hash) af hvert møde, der sidst blev eksporteret til Google Sheets
+        self.sheet_exports = {}
+        # Arkivindeks: {segment: {"serials": [...], "first": dato, "last": dato}} for møder,
+        # der er flyttet ud af self.meetings og ligger i storage.archive
+        self.archived = {}
+        self._archived_serials = set()
+        self.stats = MeetingStats()
+        self._seq = 0
+        self._rebuild_indexes()
+
+    # Møderne kan indlæses dovent: storage kan levere en 'meetings_loader' i stedet
+    # for selve listen, og den kaldes først, når møderne tilgås
+    @property
+    def meetings(self):
+        if self._meetings_loader is not None:
+            self._ensure_meetings()
+        return self._meetings
+
+    def _ensure_meetings(self):
+        # Indlæsningen sker under skrivelåsen, så en anden tråd ikke ser en halvt indlæst
+        # liste. Metoder, der læser møderne under læselåsen, kalder den først, da en læser
+        # ikke må bede om skrivelåsen. Låsene tages uden _writing: møderne skal passe til
+        # den tilstand, der allerede er i hukommelsen, og indlæsningen kan ske midt i en
+        # afspilning af en anden proces' poster
+        if self._meetings_loader is None:
+            return
+        with self._lock.write(), self.storage.lock():
+            if self._meetings_loader is None:
+                return
+            try:
+                meetings = self._meetings_loader()
+            except FileNotFoundError:
+                # En anden proces har komprimeret og fjernet mødefilen, siden snapshottet
+                # blev læst. Indlæs den nyeste tilstand i stedet; filerne kan ikke skifte
+                # igen, mens låsen holdes
+                self._reload()
+                if self._meetings_loader is None:
+                    return
+                meetings = self._meetings_loader()
+            self.meetings = meetings
+
+    @meetings.setter
+    def meetings(self, meetings):
+        self._meetings_loader = None
+        self._meetings = meetings
 
     def load_data(self):
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                self.participants = self.convert_participants(data.get("participants", []))
+        data = self.storage.load_snapshot()
+        normalised = False
+        legacy = False
+        if data is not None:
+            self.participants = self.convert_participants(data.get("participants", []))
+            if "meetings_loader" in data:
+                self._meetings_loader = data["meetings_loader"]
+            else:
                 self.meetings = data.get("meetings", [])
-                self.group_affiliations = set(data.get("group_affiliations", []))
-                self.last_meeting_serial = data.get("last_meeting_serial", 0)
-                self.group_history = data.get("group_history", {})
-                self.ensure_meeting_numbers()  # Kald denne metode efter indlæsning af data
-        else:
+            self.group_affiliations = set(data.get("group_affiliations", []))
+            self.last_meeting_serial = data.get("last_meeting_serial", 0)
+            self.group_history = data.get("group_history", {})
+            self.sheet_exports = data.get("sheet_exports", {})
+            self.archived = data.get("archive", {})
+            self._index_archive()
+            if "participation" in data:
+                self.stats = MeetingStats(PairCounts.from_dict(data["pair_counts"]), data["participation"])
+            else:
+                # Ældre data havde parhistorik i participant['groupings'] og et mødetal, der
+                # aldrig blev talt op. Begge genopbygges fra møderne
+                self.stats = MeetingStats()
+                self.stats.rebuild(self.meetings)
+                legacy = True
+            for participant in self.participants:
+                participant.pop('groupings', None)
+                participant.pop('meetings', None)
+            self._seq = data.get("seq", 0)
+            normalised = data.get("meetings_normalised", False)
+            self._rebuild_indexes()
+        elif not self.storage.exists():
             self.save_data()
+            self._storage_version = self.storage.version()
+            return
+
+        self._replay_journal()
+        # Snapshots skrevet af denne version har allerede normaliserede møder, så
+        # historikken hverken skal gennemløbes eller indlæses ved opstart
+        # Ældre data migreres én gang og gemmes i det nye format, så genopbygningen ikke
+        # gentages ved hver opstart
+        if not normalised:
+            legacy = not self.ensure_meeting_numbers() and data is not None
+        if legacy:
+            self.save_data()
+        self._storage_version = self.storage.version()
+
+    def _replay_journal(self):
+        # Afspil loggen oven på snapshottet. Poster, som allerede er foldet ind i
+        # snapshottet (fx hvis et nedbrud skete før loggen blev ryddet), springes over
+        self._replaying = True
+        try:
+            for record in self.storage.read_journal():
+                if record['seq'] <= self._seq:
+                    continue
+                getattr(self, f"_apply_{record['op']}")(**record['args'])
+                self._seq = record['seq']
+        finally:
+            self._replaying = False
+
+    @contextmanager
+    def _writing(self):
+        # Skrivelås i processen og på datafilerne. Har en anden proces skrevet siden
+        # sidst, indhentes dens ændringer, før vores ændring udføres oven på dem
+        with self._lock.write(), self.storage.lock():
+            if self._storage_version is not None and self.storage.version() != self._storage_version:
+                self._catch_up()
+            yield
+
+    def _catch_up(self):
+        current = self.storage.version()
+        if self.storage.replayable(self._storage_version, current):
+            self._replay_journal()
+        else:
+            self._reload()
+        self._storage_version = self.storage.version()
+
+    def _reload(self):
+        with self._render_lock:
+            self._render_cache.clear()
+        self._reset_state()
+        self._storage_version = None
+        self.load_data()
+
+    def refresh(self):
+        # Hent ændringer fra andre processer, fx ved starten af hver Streamlit-kørsel
+        with self._writing():
+            pass
+
+    @contextmanager
+    def batch(self):
+        # Saml alle ændringer i blokken og skriv kun til disk én gang til sidst.
+        # Låsene holdes i hele blokken, så ingen anden skriver kan nå ind imellem
+        with self._writing():
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    if self._batch_dirty:
+                        self.save_data()
+                    else:
+                        self._flush_journal()
+
+    def _commit(self, op, **args):
+        # Udfør ændringen i hukommelsen og læg en lille post i loggen i stedet
+        # for at skrive hele tilstanden
+        with self._writing():
+            result = getattr(self, f"_apply_{op}")(**args)
+            if not self._replaying:
+                self._seq += 1
+                # Posten serialiseres med det samme, så senere ændringer af de samme
+                # objekter ikke sniger sig ind i den
+                self._pending_records.append(json.dumps({'seq': self._seq, 'op': op, 'args': args}, default=dict))
+                if not self._batch_depth:
+                    self._flush_journal()
+            return result
+
+    @property
+    def revision(self):
+        # Tælles op ved hver ændring
+        return self._seq
+
+    def _flush_journal(self):
+        if not self._pending_records:
+            return
+        self.storage.append(self._pending_records, self)
+        self._pending_records = []
+        self._storage_version = self.storage.version()
+        if self.storage.needs_compaction():
+            self.compact()
+
+    def compact(self):
+        # Samtidig med det nye snapshot flyttes gamle møder i arkivet, så snapshottet
+        # ikke vokser med historikken
+        with self.batch():
+            self.archive_meetings()
+            self._batch_dirty = True
 
     def save_data(self):
-        data = {
-            "participants": self.participants,
+        if self._batch_depth:
+            self._batch_dirty = True
+            return
+        with self._writing():
+            self._batch_dirty = False
+            self.storage.write_snapshot(self._snapshot_state(), self)
+            # Snapshottet indeholder nu alt fra loggen
+            self._pending_records = []
+            if self._storage_version is not None:
+                self._storage_version = self.storage.version()
+
+    def _snapshot_state(self):
+        return {
+            "participants": [dict(p) for p in self.participants],
             "meetings": self.meetings,
             "group_affiliations": list(self.group_affiliations),
             "last_meeting_serial": self.last_meeting_serial,
-            "group_history": self.group_history
+            "group_history": self.group_history,
+            "sheet_exports": self.sheet_exports,
+            "archive": self.archived,
+            "pair_counts": self.pair_counts.to_dict(),
+            "participation": dict(self.stats.participation),
+            "seq": self._seq,
+            "meetings_normalised": True
         }
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f)
 
     def convert_participants(self, participants_data):
         if isinstance(participants_data, dict):
-            return [{"id": str(uuid.uuid4()), "name": name, **data} for name, data in participants_data.items()]
+            return [Participant({"id": str(uuid.uuid4()), "name": name, **data}) for name, data in participants_data.items()]
         elif isinstance(participants_data, list):
-            return [{"id": p.get("id", str(uuid.uuid4())), **p} for p in participants_data]
+            participants = [Participant(p) for p in participants_data]
+            for participant in participants:
+                if 'id' not in participant:
+                    participant['id'] = str(uuid.uuid4())
+            return participants
         else:
             return []
 
+    # Opslagsindekser, så navne- og id-opslag ikke scanner hele deltagerlisten
+    def _rebuild_indexes(self):
+        self._roster_generation += 1
+        self._participants_by_name = {}
+        self._participants_by_id = {}
+        for participant in self.participants:
+            self._index_participant(participant)
+
+    def _index_participant(self, participant):
+        self._participant_revisions[participant.get('name')] = next(self._revisions)
+        # Ved dubletnavne vinder den første, ligesom det tidligere lineære opslag
+        self._participants_by_name.setdefault(participant.get('name'), participant)
+        if 'id' in participant:
+            self._participants_by_id[participant['id']] = participant
+
+    def _unindex_participant(self, participant):
+        name = participant.get('name')
+        self._participant_revisions[name] = next(self._revisions)
+        if self._participants_by_name.get(name) is participant:
+            del self._participants_by_name[name]
+            replacement = next((p for p in self.participants if p.get('name') == name and p is not participant), None)
+            if replacement:
+                self._participants_by_name[name] = replacement
+        if self._participants_by_id.get(participant.get('id')) is participant:
+            del self._participants_by_id[participant['id']]
+
+    def _replace_participant(self, i, participant):
+        # Samme plads og id: indeksposterne byttes direkte. Kun et navneskifte for den
+        # deltager, der står i navneindekset, kræver søgningen efter en erstatning
+        current = self.participants[i]
+        self.participants[i] = participant
+        name = participant.get('name')
+        if current.get('name') != name or self._participants_by_name.get(name) is not current:
+            self._unindex_participant(current)
+            self._index_participant(participant)
+            return
+        self._participant_revisions[name] = next(self._revisions)
+        self._participants_by_name[name] = participant
+        if self._participants_by_id.get(current.get('id')) is current:
+            del self._participants_by_id[current['id']]
+        if 'id' in participant:
+            self._participants_by_id[participant['id']] = participant
+
+    def get_participant_by_name(self, name):
+        return self._participants_by_name.get(name)
+
+    def get_participant_by_id(self, participant_id):
+        return self._participants_by_id.get(participant_id)
+
+    def _get_meeting_by_serial(self, serial):
+        return next((m for m in self.meetings if m.get('serial') == serial), None)
+
     def add_group_affiliation(self, group):
-        if group and group not in self.group_affiliations:
-            self.group_affiliations.add(group)
-            self.save_data()
-            return True
-        return False
+        with self._writing():
+            if group and group not in self.group_affiliations:
+                self._commit('add_group_affiliation', group=group)
+                return True
+            return False
+
+    def _apply_add_group_affiliation(self, group):
+        self.group_affiliations.add(group)
 
     def add_participant(self, name, data):
         data['id'] = str(uuid.uuid4())
-        self.participants.append(data)
-        for group in data.get('groups', []):
-            self.add_group_affiliation(group)
-        self.save_data()
+        self._commit('add_participant', participant=data)
         return True
 
+    def _apply_add_participant(self, participant):
+        participant = Participant.from_dict(participant)
+        self.participants.append(participant)
+        self._index_participant(participant)
+        self.group_affiliations.update(g for g in participant.get('groups', []) if g)
+
+    def sync_participants(self, added, updated, removed):
+        # Upsert-synkronisering: nye, ændrede og fjernede deltagere i én post i loggen.
+        # Ændrede deltagere beholder deres id
+        for data in added:
+            data['id'] = str(uuid.uuid4())
+        if added or updated or removed:
+            self._commit('sync_participants', added=added, updated=updated, removed=removed)
+
+    def _apply_sync_participants(self, added, updated, removed):
+        if removed:
+            removed = set(removed)
+            gone = [p for p in self.participants if p.get('id') in removed]
+            self.participants = [p for p in self.participants if p.get('id') not in removed]
+            if len(gone) > 100:
+                self._rebuild_indexes()
+            else:
+                for participant in gone:
+                    self._unindex_participant(participant)
+        if updated:
+            positions = {p.get('id'): i for i, p in enumerate(self.participants)}
+            for participant in map(Participant.from_dict, updated):
+                self._replace_participant(positions[participant['id']], participant)
+        for participant in map(Participant.from_dict, added):
+            self.participants.append(participant)
+            self._index_participant(participant)
+        # Tilhørsgrupperne afspejler rosteren efter synkroniseringen, som ved en fuld import
+        self.group_affiliations = {g for p in self.participants for g in p.get('groups', []) if g}
+
     def update_participant(self, participant_id, data):
-        for i, participant in enumerate(self.participants):
-            if participant['id'] == participant_id:
-                self.participants[i] = data
-                for group in data.get('groups', []):
-                    self.add_group_affiliation(group)
-                self.save_data()
+        with self._writing():
+            if participant_id in self._participants_by_id:
+                self._commit('update_participant', participant_id=participant_id, participant=data)
                 return True
-        return False
+            return False
+
+    def _apply_update_participant(self, participant_id, participant):
+        participant = Participant.from_dict(participant)
+        participant.setdefault('id', participant_id)
+        current = self._participants_by_id[participant_id]
+        i = next(i for i, p in enumerate(self.participants) if p is current)
+        self._replace_participant(i, participant)
+        self.group_affiliations.update(g for g in participant.get('groups', []) if g)
 
     def remove_participant(self, participant_id):
-        self.participants = [p for p in self.participants if p['id'] != participant_id]
-        self.save_data()
-        return True
+        with self._writing():
+            if participant_id in self._participants_by_id:
+                self._commit('remove_participant', participant_id=participant_id)
+            return True
+
+    def _apply_remove_participant(self, participant_id):
+        participant = self._participants_by_id[participant_id]
+        self.participants = [p for p in self.participants if p is not participant]
+        self._unindex_participant(participant)
 
     def remove_all_participants(self):
+        with self._writing():
+            self._commit('remove_all_participants')
+            # Segmentfilerne slettes her og ikke i _apply, så en afspilning af loggen
+            # ikke rammer segmenter, der er skrevet senere
+            self.storage.archive.clear()
+
+    def _apply_remove_all_participants(self):
         self.participants.clear()
         self.meetings.clear()
-        self.save_data()
+        self.archived = {}
+        self._index_archive()
+        self.stats.clear()
+        self._rebuild_indexes()
 
     def create_meeting(self, groups, date, meeting_number=None):
-        self.last_meeting_serial += 1
-        formatted_date = datetime.strptime(date, "%Y-%m-%d").strftime("%d. %B %Y")
-        
-        if meeting_number is None:
-            meeting_number = self.last_meeting_serial
-        
-        meeting_name = f"Møde {meeting_number} - {formatted_date}"
-        
-        self.meetings.append({
-            'serial': self.last_meeting_serial,
-            'name': meeting_name,
-            'date': date,
-            'formatted_date': formatted_date,
-            'meeting_number': meeting_number,
-            'groups': [[p if isinstance(p, str) else p.get('name', 'Unavngivet') for p in group] for group in groups]
-        })
-        self.update_groupings(groups)
-        self.save_data()
-        
-        return meeting_name
+        with self._writing():
+            serial = self.last_meeting_serial + 1
+            formatted_date = datetime.strptime(date, "%Y-%m-%d").strftime("%d. %B %Y")
+
+            if meeting_number is None:
+                meeting_number = serial
+
+            meeting_name = f"Møde {meeting_number} - {formatted_date}"
+
+            self._commit('create_meeting', meeting={
+                'serial': serial,
+                'name': meeting_name,
+                'date': date,
+                'formatted_date': formatted_date,
+                'meeting_number': meeting_number,
+                'groups': [[p if isinstance(p, str) else p.get('name', 'Unavngivet') for p in group] for group in groups]
+            })
+
+            return meeting_name
+
+    def _apply_create_meeting(self, meeting):
+        self._touch_meeting(meeting['serial'])
+        self.last_meeting_serial = max(self.last_meeting_serial, meeting['serial'])
+        self.meetings.append(meeting)
+        self.stats.apply_meeting(meeting['groups'])
 
     def reset_meeting_numbers(self):
-        for i, meeting in enumerate(self.meetings, 1):
+        self._commit('reset_meeting_numbers')
+
+    def _apply_reset_meeting_numbers(self):
+        # Arkiverede møder beholder deres numre; de aktive nummereres videre derfra
+        for i, meeting in enumerate(self.meetings, self.archived_count + 1):
+            self._touch_meeting(meeting['serial'])
             meeting['meeting_number'] = i
             meeting['name'] = f"Møde {i} - {meeting['formatted_date']}"
-        self.save_data()
 
     def ensure_meeting_numbers(self):
-        for i, meeting in enumerate(self.meetings, 1):
+        # Migrering af ældre møder. Der skrives kun til disk, hvis noget faktisk er ændret
+        changed = False
+        for i, meeting in enumerate(self.meetings, self.archived_count + 1):
             if 'meeting_number' not in meeting:
                 meeting['meeting_number'] = i
+                changed = True
             if 'formatted_date' not in meeting:
                 formatted_date = datetime.strptime(meeting['date'], "%Y-%m-%d").strftime("%d. %B %Y")
                 meeting['formatted_date'] = formatted_date
-            meeting['name'] = f"Møde {meeting['meeting_number']} - {meeting['formatted_date']}"
-        self.save_data()
+                changed = True
+            name = f"Møde {meeting['meeting_number']} - {meeting['formatted_date']}"
+            if meeting.get('name') != name:
+                meeting['name'] = name
+                changed = True
+        if changed:
+            self.save_data()
+        return changed
 
-    def update_groupings(self, groups):
-        for group in groups:
-            for participant in group:
-                participant_data = next((p for p in self.participants if p['name'] == participant), None)
-                if participant_data:
-                    if 'groupings' not in participant_data:
-                        participant_data['groupings'] = {}
-                    for other in group:
-                        if participant != other:
-                            participant_data['groupings'][other] = participant_data['groupings'].get(other, 0) + 1
+    def mark_meetings_exported(self, versions):
+        # versions: {serial: hash af mødets eksporterede rækker}
+        self._commit('mark_meetings_exported', versions={str(serial): version for serial, version in versions.items()})
+
+    def _apply_mark_meetings_exported(self, versions):
+        self.sheet_exports.update(versions)
 
     def update_meeting_date(self, index, new_date):
-        if 0 <= index < len(self.meetings):
-            self.meetings[index]["date"] = new_date
-            self.save_data()
-            return True
-        return False
+        with self._writing():
+            if 0 <= index < len(self.meetings):
+                self._commit('update_meeting_date', serial=self.meetings[index]['serial'], date=new_date)
+                return True
+            return False
+
+    def _apply_update_meeting_date(self, serial, date):
+        self._touch_meeting(serial)
+        self._get_meeting_by_serial(serial)["date"] = date
 
     def delete_meeting(self, index):
-        if 0 <= index < len(self.meetings):
-            deleted_meeting = self.meetings.pop(index)
-            for group in deleted_meeting['groups']:
-                for participant_name in group:
-                    participant = next((p for p in self.participants if p['name'] == participant_name), None)
-                    if participant:
-                        participant['meetings'] = max(0, participant.get('meetings', 0) - 1)
-            self.save_data()
-            return True
-        return False
+        with self._writing():
+            if 0 <= index < len(self.meetings):
+                self._commit('delete_meeting', serial=self.meetings[index]['serial'])
+                return True
+            return False
+
+    def _apply_delete_meeting(self, serial):
+        self._meeting_versions.pop(serial, None)
+        index = next(i for i, m in enumerate(self.meetings) if m.get('serial') == serial)
+        deleted_meeting = self.meetings.pop(index)
+        self.stats.apply_meeting(deleted_meeting['groups'], -1)
+
+    def archive_meetings(self, before=None):
+        # Flyt møder dateret før 'before' (standard: ARCHIVE_AFTER_DAYS dage siden) til
+        # komprimerede segmenter. Par- og deltagelsestallene er uændrede, og de arkiverede
+        # møder kan stadig læses til eksport og historik. Returnerer antallet af flyttede møder
+        if before is None:
+            before = date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)
+        before = str(before)
+        with self._writing():
+            old = [meeting for meeting in self.meetings if str(meeting['date']) < before]
+            if not old:
+                return 0
+            # Segmenterne skrives, før posten logges; indekset afgør, hvad der gælder
+            segments = self.storage.archive.write(self.archived, old)
+            self._commit('archive_meetings', segments=segments, serials=[meeting['serial'] for meeting in old])
+            return len(old)
+
+    def _apply_archive_meetings(self, segments, serials):
+        serials = set(serials)
+        self.meetings = [meeting for meeting in self.meetings if meeting['serial'] not in serials]
+        self.archived.update(segments)
+        self._index_archive()
+
+    def _index_archive(self):
+        self._archived_serials = {serial for entry in self.archived.values() for serial in entry['serials']}
+
+    @property
+    def archived_count(self):
+        return len(self._archived_serials)
+
+    def is_archived(self, meeting):
+        return meeting.get('serial') in self._archived_serials
+
+    def _archived_meetings(self, start=None, end=None, serials=None, newest_first=False):
+        # Indlæser kun de segmenter, der kan indeholde møder i intervallet eller med de givne serienumre
+        for name in sorted(self.archived, reverse=newest_first):
+            entry = self.archived[name]
+            if (start is not None and entry['last'] < start) or (end is not None and entry['first'] > end):
+                continue
+            if serials is not None and serials.isdisjoint(entry['serials']):
+                continue
+            meetings = self.storage.archive.load(name, entry['serials'])
+            for meeting in reversed(meetings) if newest_first else meetings:
+                if (start is None or meeting['date'] >= start) and (end is None or meeting['date'] <= end):
+                    yield meeting
+
+    def iter_all_meetings(self):
+        # Arkiverede og aktive møder, ældste først
+        return itertools.chain(self._archived_meetings(), list(self.meetings))
+
+    @property
+    def pair_counts(self):
+        return self.stats.pair_counts
+
+    def rebuild_stats(self):
+        # Genberegn parhistorik og deltagelsestal fra alle møder (reparation)
+        self.stats.rebuild(list(self.iter_all_meetings()))
+        self.save_data()
+
+    def verify_stats(self):
+        return self.stats.matches(list(self.iter_all_meetings()))
+
+    def _meetings_in_range(self, start_date=None, end_date=None):
+        # Nyeste først, som i historikvisningen: de aktive møder og derefter arkivet.
+        # Datoerne er ISO-strenge og kan sammenlignes direkte
+        start = str(start_date) if start_date else None
+        end = str(end_date) if end_date else None
+        for meeting in reversed(self.meetings):
+            if (start is None or meeting['date'] >= start) and (end is None or meeting['date'] <= end):
+                yield meeting
+        yield from self._archived_meetings(start, end, newest_first=True)
+
+    def count_meetings(self, start_date=None, end_date=None):
+        self._ensure_meetings()
+        with self._lock.read():
+            if start_date is None and end_date is None:
+                return len(self.meetings) + self.archived_count
+            start = str(start_date) if start_date else None
+            end = str(end_date) if end_date else None
+            count = sum(1 for m in self.meetings if (start is None or m['date'] >= start) and (end is None or m['date'] <= end))
+            for name, entry in self.archived.items():
+                if (start is None or entry['first'] >= start) and (end is None or entry['last'] <= end):
+                    # Hele segmentet ligger i intervallet og skal ikke indlæses
+                    count += len(entry['serials'])
+                elif not ((start is not None and entry['last'] < start) or (end is not None and entry['first'] > end)):
+                    count += sum(1 for _ in self._archived_meetings(start, end, serials=set(entry['serials'])))
+            return count
+
+    def get_meetings_page(self, page, page_size, start_date=None, end_date=None):
+        self._ensure_meetings()
+        with self._lock.read():
+            if start_date is None and end_date is None:
+                end = len(self.meetings) - page * page_size
+                page_meetings = list(reversed(self.meetings[max(0, end - page_size):max(0, end)]))
+                if len(page_meetings) < page_size and self.archived:
+                    # Siden fortsætter ind i arkivet. Hele segmenter foran siden springes over uden at blive indlæst
+                    skip = max(0, -end)
+                    for name in sorted(self.archived, reverse=True):
+                        entry = self.archived[name]
+                        if skip >= len(entry['serials']):
+                            skip -= len(entry['serials'])
+                            continue
+                        meetings = self.storage.archive.load(name, entry['serials'])[::-1]
+                        page_meetings.extend(meetings[skip:skip + page_size - len(page_meetings)])
+                        skip = 0
+                        if len(page_meetings) >= page_size:
+                            break
+                return page_meetings
+            return list(itertools.islice(self._meetings_in_range(start_date, end_date), page * page_size, (page + 1) * page_size))
+
+    def _queries(self):
+        # Storage, der selv kan besvare statistik og eksport (SQLite), bruges kun, når
+        # databasen svarer til tilstanden i hukommelsen: uden for en batch og uden
+        # ændringer fra andre processer, som endnu ikke er indhentet
+        if self.storage.supports_queries and not self._batch_depth and self.storage.version() == self._storage_version:
+            return self.storage
+        return None
 
     def get_participation_stats(self):
-        return {participant['name']: participant.get("meetings", 0) for participant in self.participants}
+        with self._lock.read():
+            queries = self._queries()
+            if queries is not None:
+                return queries.get_participation_stats()
+            return {participant['name']: self.stats.participation.get(participant['name'], 0) for participant in self.participants}
 
     def get_grouping_stats(self, participant_name):
-        participant = next((p for p in self.participants if p['name'] == participant_name), None)
-        if participant:
-            return participant.get("groupings", {})
-        return {}
+        with self._lock.read():
+            participant = self._participants_by_name.get(participant_name)
+            if not participant:
+                return {}
+            queries = self._queries()
+            if queries is not None:
+                return queries.get_grouping_stats(participant_name)
+            return self.pair_counts.row(participant_name)
 
     def manual_group_matching(self, attendees, existing_groups=None):
         if existing_groups is None:
             groups = [[] for _ in range((len(attendees) + 3) // 4)]
         else:
-            groups = existing_groups
+            # Kopier grupperne: det, der returneres, redigeres på stedet af UI'et, og må
+            # ikke være mødets egne lister, før update_meeting_groups kaldes
+            groups = [list(group) for group in existing_groups]
         
         assigned_participants = set([p for group in groups for p in group])
         unassigned = [p for p in attendees if p not in assigned_participants]
@@ -174,82 +655,208 @@ class InteractiveGroupScheduler:
         return groups, unassigned
 
     def update_meeting_groups(self, meeting_index, new_groups):
-        if 0 <= meeting_index < len(self.meetings):
-            self.meetings[meeting_index]["groups"] = new_groups
-            self.update_groupings(new_groups)
-            self.save_data()
-            return True
-        return False
-
-    def export_meetings_to_dataframe(self):
-        meetings_data = []
-        for meeting in self.meetings:
-            date = meeting['date']
-            if isinstance(date, str):
-                try:
-                    date = datetime.strptime(date, "%Y-%m-%d").date()
-                except ValueError:
-                    pass
+        with self._writing():
+            if 0 <= meeting_index < len(self.meetings):
+                self._commit('update_meeting_groups', serial=self.meetings[meeting_index]['serial'], groups=new_groups)
+                return True
+            return False
+
+    def update_meeting_groups_by_serial(self, serial, new_groups):
+        # Serienummeret ændres ikke, når andre møder slettes eller arkiveres, så det kan
+        # gemmes mellem to kørsler. Er mødet væk (slettet eller arkiveret), returneres False
+        with self._writing():
+            if self._get_meeting_by_serial(serial) is not None:
+                self._commit('update_meeting_groups', serial=serial, groups=new_groups)
+                return True
+            return False
+
+    def _apply_update_meeting_groups(self, serial, groups):
+        self._touch_meeting(serial)
+        meeting = self._get_meeting_by_serial(serial)
+        old_groups = meeting["groups"]
+        meeting["groups"] = groups
+        self.stats.apply_edit(old_groups, groups)
+
+    MEETING_EXPORT_COLUMNS = ['Møde-ID', 'Mødenavn', 'Dato', 'Gruppe', 'Deltager', 'Tilhørsgruppe']
+
+    def iter_meeting_rows(self, start_date=None, end_date=None, serials=None):
+        # Én række ad gangen, så eksport af hele historikken ikke skal ligge i hukommelsen.
+        # Kan storage selv levere de aktive møders rækker, hentes de derfra, så møderne
+        # ikke skal indlæses
+        start = str(start_date) if start_date else None
+        end = str(end_date) if end_date else None
+        serials = {str(serial) for serial in serials} if serials is not None else None
+        archived = self._archived_meetings(start, end, {int(s) for s in serials if s.isdigit()} if serials is not None else None)
+        queries = self._queries()
+        for meeting in itertools.chain(archived, [] if queries is not None else list(self.meetings)):
+            if start is not None and meeting['date'] < start:
+                continue
+            if end is not None and meeting['date'] > end:
+                continue
+            if serials is not None and str(meeting.get('serial', '')) not in serials:
+                continue
+            date = self._export_date(meeting['date'])
             for group_index, group in enumerate(meeting['groups'], 1):
                 for participant in group:
-                    participant_data = next((p for p in self.participants if p['name'] == participant), None)
+                    participant_data = self._participants_by_name.get(participant)
                     if participant_data:
                         affiliations = ', '.join(participant_data.get('groups', ['Ikke tildelt']))
-                        meetings_data.append({
-                            'Møde-ID': str(meeting.get('serial', '')),
-                            'Mødenavn': meeting.get('name', ''),
-                            'Dato': date,
-                            'Gruppe': f"Gruppe {group_index}",
-                            'Deltager': participant,
-                            'Tilhørsgruppe': affiliations
-                        })
-        return pd.DataFrame(meetings_data)
-
-    def shuffle_groups(self, group_size):
-        participants = [p['name'] for p in self.participants]
-        random.shuffle(participants)
-
-        groups = []
-        group_affiliations = defaultdict(set)
-
-        while participants:
-            group = []
-            for _ in range(group_size):
-                if not participants:
-                    break
-                
-                best_participant = None
-                min_conflicts = float('inf')
-                
-                for participant in participants:
-                    participant_data = next((p for p in self.participants if p['name'] == participant), None)
-                    if not participant_data:
-                        continue
-
-                    participant_affiliations = set(participant_data.get('groups', ['Ikke tildelt']))
-                    conflicts = len(participant_affiliations.intersection(group_affiliations[len(groups)]))
-                    
-                    if conflicts < min_conflicts:
-                        min_conflicts = conflicts
-                        best_participant = participant
-
-                if best_participant:
-                    group.append(best_participant)
-                    participants.remove(best_participant)
-                    participant_data = next((p for p in self.participants if p['name'] == best_participant), None)
-                    group_affiliations[len(groups)].update(participant_data.get('groups', ['Ikke tildelt']))
-
-            if len(group) >= 3:
-                groups.append(group)
-            elif groups and len(groups[-1]) + len(group) <= group_size + 1:
-                groups[-1].extend(group)
+                        yield self._meeting_row(meeting.get('serial', ''), meeting.get('name', ''), date, group_index,
+                                                participant, affiliations)
+        if queries is not None:
+            dates = {}
+            for serial, name, date, group_index, participant, affiliations in queries.iter_meeting_rows(start, end, serials):
+                if date not in dates:
+                    dates[date] = self._export_date(date)
+                yield self._meeting_row(serial, name or '', dates[date], group_index + 1, participant, affiliations)
+
+    @staticmethod
+    def _export_date(date):
+        if isinstance(date, str):
+            try:
+                return datetime.strptime(date, "%Y-%m-%d").date()
+            except ValueError:
+                pass
+        return date
+
+    @staticmethod
+    def _meeting_row(serial, name, date, group_number, participant, affiliations):
+        return {
+            'Møde-ID': str(serial),
+            'Mødenavn': name,
+            'Dato': date,
+            'Gruppe': f"Gruppe {group_number}",
+            'Deltager': participant,
+            'Tilhørsgruppe': affiliations
+        }
+
+    def iter_meeting_chunks(self, chunk_size=10000, **filters):
+        chunk = []
+        for row in self.iter_meeting_rows(**filters):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def export_meetings_to_dataframe(self, **filters):
+        # pandas importeres først her, så scheduleren kan bruges uden (fx fra cli.py)
+        import pandas as pd
+        self._ensure_meetings()
+        with self._lock.read():
+            return pd.DataFrame(list(self.iter_meeting_rows(**filters)))
+
+    def _grouping_problem(self, constraints=None):
+        # Kun opbygningen af problemet læser delt tilstand; selve optimeringen kører uden lås
+        with self._lock.read():
+            return GroupingProblem.from_participants(self.participants, self.pair_counts, constraints)
+
+    def _note_result(self, problem, score, plan):
+        self.last_shuffle_score = score
+        # Antal regelbrud summeret over møderne: (sammen trods forbud, adskilt trods krav, over grænse)
+        self.last_constraint_violations = None
+        if problem.constraints is not None:
+            self.last_constraint_violations = tuple(
+                map(sum, zip(*(problem.constraints.violations(groups) for groups in plan))))
+        return self.last_constraint_violations
+
+    def shuffle_groups(self, group_size, min_size=DEFAULT_MIN_SIZE, max_size=None, time_budget=DEFAULT_TIME_BUDGET,
+                       max_iterations=None, seed=None, constraints=None):
+        # Minimerer sammenfald i tilhørsgruppe og gentagne makkerpar fra tidligere møder.
+        # 'constraints' er valgfrie regler (GroupingConstraints)
+        problem = self._grouping_problem(constraints)
+        groups, score = optimise_groups(problem, group_size, min_size=min_size, max_size=max_size,
+                                        time_budget=time_budget, max_iterations=max_iterations, seed=seed)
+        self._note_result(problem, score, [groups])
+        return [[problem.names[i] for i in group] for group in groups], 0  # Alle deltagere bliver fordelt
+
+    def shuffle_groups_parallel(self, group_size, workers=None, seeds=None, runs=None, time_budget=DEFAULT_TIME_BUDGET,
+                                min_size=DEFAULT_MIN_SIZE, max_size=None, constraints=None):
+        # Som shuffle_groups, men med mange uafhængige starter fordelt på flere processer.
+        # Returnerer (grupper, score) for den bedste kørsel
+        problem = self._grouping_problem(constraints)
+        groups, score, _ = optimise_groups_parallel(problem, group_size, workers=workers, seeds=seeds, runs=runs,
+                                                    time_budget=time_budget, min_size=min_size, max_size=max_size)
+        self._note_result(problem, score, [groups])
+        return [[problem.names[i] for i in group] for group in groups], score
+
+    def plan_meetings(self, number_of_meetings, group_size, min_size=DEFAULT_MIN_SIZE, max_size=None,
+                      time_budget=None, seed=None, constraints=None):
+        # Planlæg flere møder i ét kald, så makkerpar ikke gentages på tværs af møderne
+        problem = self._grouping_problem(constraints)
+        plan, score = plan_sequence(problem, number_of_meetings, group_size, min_size=min_size, max_size=max_size,
+                                    time_budget=time_budget, seed=seed)
+        self._note_result(problem, score, plan)
+        return [[[problem.names[i] for i in group] for group in groups] for groups in plan]
+
+    def start_planning(self, number_of_meetings, group_size, min_size=DEFAULT_MIN_SIZE, max_size=None,
+                       time_budget=None, seed=None, constraints=None):
+        # Som plan_meetings, men i baggrunden. Returnerer et GroupingJob, der løbende
+        # offentliggør den bedste plan (med navne) og kan stoppes før tid
+        if time_budget is None:
+            time_budget = DEFAULT_TIME_BUDGET * number_of_meetings
+        problem = self._grouping_problem(constraints)
+
+        def names(plan):
+            return [[[problem.names[i] for i in group] for group in groups] for groups in plan]
+
+        def run(should_stop, publish):
+            def on_progress(progress, plan, score):
+                publish(progress, names(plan) if plan is not None else None, score)
+            plan, score = plan_sequence(problem, number_of_meetings, group_size, min_size=min_size, max_size=max_size,
+                                        time_budget=time_budget, seed=seed, should_stop=should_stop,
+                                        on_progress=on_progress)
+            return names(plan), score, self._note_result(problem, score, plan)
+
+        return GroupingJob(run, time_budget).start()
+
+    # Cache af renderet mødeindhold. Nøglen ændrer sig, når mødet eller data for
+    # en af dets deltagere ændres, så kun de berørte møder beregnes igen
+    RENDER_CACHE_SIZE = 512
+
+    def _touch_meeting(self, serial):
+        self._meeting_versions[serial] = next(self._revisions)
+
+    def meeting_fingerprint(self, meeting):
+        return (
+            meeting.get('serial'),
+            self._meeting_versions.get(meeting.get('serial'), 0),
+            self._roster_generation,
+            tuple((name, self._participant_revisions.get(name, 0)) for group in meeting['groups'] for name in group),
+            tuple(len(group) for group in meeting['groups'])
+        )
+
+    def _cached_render(self, kind, meeting, render):
+        key = (kind, self.meeting_fingerprint(meeting))
+        with self._render_lock:
+            if key in self._render_cache:
+                self._render_cache.move_to_end(key)
+                return self._render_cache[key]
+        value = render(meeting)
+        with self._render_lock:
+            self._render_cache[key] = value
+            if len(self._render_cache) > self.RENDER_CACHE_SIZE:
+                self._render_cache.popitem(last=False)
+        return value
+
+    def format_group(self, index, group):
+        group_str = f"Gruppe {index}:"
+        for name in group:
+            participant = self._participants_by_name.get(name)
+            if participant:
+                affiliations = ', '.join(participant.get('groups', ['Ikke tildelt']))
+                group_str += f" {name} ({affiliations}),"
             else:
-                # Distribute remaining participants to existing groups
-                for participant in group:
-                    min_group = min(groups, key=len)
-                    min_group.append(participant)
+                group_str += f" {name} (Ukendt),"
+        return group_str.rstrip(',')
+
+    def render_meeting_groups(self, meeting):
+        return self._cached_render(
+            'groups', meeting, lambda m: [self.format_group(j, group) for j, group in enumerate(m['groups'], 1)])
 
-        return groups, 0  # Return 0 for unassigned as we've distributed all participants
+    def export_meeting_to_csv_bytes(self, meeting):
+        return self._cached_render('csv', meeting, lambda m: self.export_meeting_to_csv(m).encode('utf-8'))
 
     def export_meeting_to_csv(self, meeting):
         output = io.StringIO()
@@ -258,7 +865,7 @@ class InteractiveGroupScheduler:
         
         for i, group in enumerate(meeting['groups'], 1):
             for participant_name in group:
-                participant_data = next((p for p in self.participants if p['name'] == participant_name), None)
+                participant_data = self._participants_by_name.get(participant_name)
                 if participant_data:
                     writer.writerow([
                         f'Gruppe {i}',
@@ -0,0 +1,189 @@
+import os
+import time
+import hashlib
+import pandas as pd
+from config import SHEETS_CACHE_TTL
+
+
+# Fælles grænseflade for regneark: read, update, append_rows, delete_rows_where og
+# key_values. GSheetsTable taler med Google Sheets, LocalSheetsConnection med
+# CSV-filer i en mappe, så hele forløbet kan køres og testes offline
+
+
+# Google Sheets via st-gsheets-connection. Tilføjelse og sletning af enkelte rækker
+# går direkte til gspread-arket, så der ikke skal læses og skrives et helt ark
+class GSheetsTable:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def read(self, worksheet=None, **options):
+        # Forbindelsens egen cache (ttl=3600 som standard) slås fra; CachedSheetsReader
+        # står for caching, så den kan ugyldiggøres efter skrivninger
+        options.setdefault("ttl", 0)
+        return self.conn.read(worksheet=worksheet, **options)
+
+    def update(self, worksheet, data):
+        return self.conn.update(worksheet=worksheet, data=data)
+
+    def _worksheet(self, worksheet):
+        return self.conn.client._select_worksheet(worksheet=worksheet)
+
+    def key_values(self, worksheet, column):
+        # Læser kun overskriften og den ene kolonne
+        sheet = self._worksheet(worksheet)
+        header = sheet.row_values(1)
+        if column not in header:
+            return []
+        return sheet.col_values(header.index(column) + 1)[1:]
+
+    def append_rows(self, worksheet, data):
+        sheet = self._worksheet(worksheet)
+        rows = _sheet_values(data)
+        if not sheet.row_values(1):
+            rows = [list(data.columns)] + rows
+        sheet.append_rows(rows, value_input_option="USER_ENTERED")
+
+    def delete_rows_where(self, worksheet, column, keys):
+        sheet = self._worksheet(worksheet)
+        header = sheet.row_values(1)
+        if column not in header:
+            return 0
+        keys = {str(key) for key in keys}
+        values = sheet.col_values(header.index(column) + 1)
+        row_numbers = [number for number, value in enumerate(values, 1) if number > 1 and value in keys]
+        # Slet sammenhængende intervaller nedefra, så rækkenumrene ovenover ikke flytter sig
+        for start, end in reversed(_ranges(row_numbers)):
+            sheet.delete_rows(start, end)
+        return len(row_numbers)
+
+
+# Lokal stand-in for Google Sheets: hvert ark er en CSV-fil i 'directory'
+class LocalSheetsConnection:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, worksheet):
+        return os.path.join(self.directory, f"{worksheet or 'Ark1'}.csv")
+
+    def read(self, worksheet=None, **options):
+        path = self._path(worksheet)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return pd.DataFrame()
+        return pd.read_csv(path, dtype=str, keep_default_na=False, **options)
+
+    def update(self, worksheet, data):
+        data.to_csv(self._path(worksheet), index=False)
+        return data
+
+    def key_values(self, worksheet, column):
+        existing = self.read(worksheet)
+        return existing[column].tolist() if column in existing.columns else []
+
+    def append_rows(self, worksheet, data):
+        path = self._path(worksheet)
+        header = not os.path.exists(path) or os.path.getsize(path) == 0
+        pd.DataFrame(_sheet_values(data), columns=data.columns).to_csv(path, mode='a', header=header, index=False)
+
+    def delete_rows_where(self, worksheet, column, keys):
+        existing = self.read(worksheet)
+        if column not in existing.columns:
+            return 0
+        mask = existing[column].isin({str(key) for key in keys})
+        self.update(worksheet, existing[~mask])
+        return int(mask.sum())
+
+
+# Cache foran et regneark (GSheetsTable eller LocalSheetsConnection). Læsninger af et
+# ark genbruges i 'ttl' sekunder, og hvert ark får et fingeraftryk af indholdet, så
+# efterfølgende behandling kan springes over, når arket er uændret. Skrivninger gennem
+# cachen ugyldiggør det berørte ark
+class CachedSheetsReader:
+    def __init__(self, sheets, ttl=SHEETS_CACHE_TTL, clock=time.monotonic):
+        self.sheets = sheets
+        self.ttl = ttl
+        self.clock = clock
+        self._cache = {}
+
+    def read(self, worksheet=None, **options):
+        return self.read_with_fingerprint(worksheet, **options)[0]
+
+    def read_with_fingerprint(self, worksheet=None, **options):
+        entry = self._cache.get(worksheet)
+        if entry is None or options or (self.ttl is not None and self.clock() - entry[0] >= self.ttl):
+            data = self.sheets.read(worksheet, **options)
+            entry = (self.clock(), data, fingerprint(data))
+            if not options:
+                self._cache[worksheet] = entry
+        return entry[1], entry[2]
+
+    def fingerprint(self, worksheet=None):
+        return self.read_with_fingerprint(worksheet)[1]
+
+    def invalidate(self, worksheet=None):
+        # Uden argument ryddes hele cachen
+        if worksheet is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(worksheet, None)
+
+    def key_values(self, worksheet, column):
+        return self.sheets.key_values(worksheet, column)
+
+    def update(self, worksheet, data):
+        self.invalidate(worksheet)
+        return self.sheets.update(worksheet, data)
+
+    def append_rows(self, worksheet, data):
+        self.invalidate(worksheet)
+        return self.sheets.append_rows(worksheet, data)
+
+    def delete_rows_where(self, worksheet, column, keys):
+        self.invalidate(worksheet)
+        return self.sheets.delete_rows_where(worksheet, column, keys)
+
+
+def fingerprint(data):
+    # Hash af kolonnenavne og alle celler; uafhængigt af hvornår arket blev læst
+    digest = hashlib.sha1(repr(list(data.columns)).encode("utf-8"))
+    if len(data):
+        digest.update(pd.util.hash_pandas_object(data.astype(str), index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def _sheet_values(data):
+    return [["" if pd.isna(value) else str(value) for value in row] for row in data.itertuples(index=False)]
+
+
+def _ranges(numbers):
+    ranges = []
+    for number in numbers:
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ranges
+
+
+# Én forbindelse og én cache per proces
+_sheets = None
+
+
+def get_sheets_connection():
+    global _sheets
+    if _sheets is None:
+        import streamlit as st
+        from streamlit_gsheets import GSheetsConnection
+        _sheets = CachedSheetsReader(GSheetsTable(st.connection("gsheets", type=GSheetsConnection)))
+    return _sheets
+
+
+def cached_reader(sheets):
+    # En forbindelse, der ikke allerede læser gennem cachen, pakkes ind i en CachedSheetsReader
+    return sheets if sheets is None or isinstance(sheets, CachedSheetsReader) else CachedSheetsReader(sheets)
+
+
+def set_sheets_connection(sheets):
+    # Brug fx en LocalSheetsConnection i stedet for Google Sheets (test og udvikling)
+    global _sheets
+    _sheets = cached_reader(sheets)
@@ -51,8 +51,7 @@ def remove_all_members(scheduler):
 # def display_sheet_data(scheduler):
 #     st.sidebar.subheader("Medlemsdata fra Google Sheets")
     
-#     conn = st.connection("gsheets", type=GSheetsConnection)
-#     df = conn.read()
+#     df = get_sheets_connection().read()  # Cachet, så der ikke læses ved hver rerun
     
 #     st.sidebar.write(f"Antal rækker i Google Sheet: {len(df)}")
 #     st.sidebar.write(f"Kolonner: {', '.join(df.columns)}")
@@ -96,7 +95,7 @@ def display_current_members(scheduler):
         selected_member_info = st.sidebar.selectbox("Vælg et medlem for at se detaljer", members, format_func=lambda x: x[0])
         if selected_member_info:
             try:
-                selected_member = next((m for m in scheduler.participants if m.get('id') == selected_member_info[1]), None)
+                selected_member = scheduler.get_participant_by_id(selected_member_info[1])
                 if selected_member:
                     st.sidebar.write(f"Navn: {selected_member.get('name', 'Ikke angivet')}")
                     st.sidebar.write(f"Grupper: {', '.join(selected_member.get('groups', ['Ikke tildelt']))}")
@@ -145,9 +144,7 @@ def add_new_participant(scheduler):
                     "company": company,
                     "position": position,
                     "industry": industry,
-                    "groups": [group] if group else [],
-                    "meetings": 0,
-                    "groupings": {}
+                    "groups": [group] if group else []
                 }
                 if scheduler.add_participant(full_name, participant_data):
                     st.sidebar.success(f"Deltager '{full_name}' er tilføjet.")
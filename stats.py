@@ -0,0 +1,79 @@
+from collections import Counter
+from pairs import PairCounts
+
+
+# Parhistorik og deltagelsestal, der holdes ajour med fortegnsbestemte deltaer, når
+# et møde oprettes (+1), redigeres eller slettes (-1), i stedet for en fuld genafspilning
+class MeetingStats:
+    def __init__(self, pair_counts=None, participation=None):
+        self.pair_counts = pair_counts if pair_counts is not None else PairCounts()
+        self.participation = Counter(participation or {})
+
+    def apply_meeting(self, groups, sign=1):
+        self.pair_counts.add_groups(groups, sign)
+        for name in {name for group in groups for name in group}:
+            self._bump(name, sign)
+
+    def apply_edit(self, old_groups, new_groups):
+        # Kun grupper, der faktisk er ændret, berøres: for hver af dem trækkes parrene
+        # med de fjernede medlemmer fra og parrene med de nye lægges til, så prisen er
+        # O(ændrede medlemmer * gruppestørrelse)
+        removed_pairs = []
+        added_pairs = []
+        for g in range(max(len(old_groups), len(new_groups))):
+            old = old_groups[g] if g < len(old_groups) else []
+            new = new_groups[g] if g < len(new_groups) else []
+            if old == new:
+                continue
+            old_set = set(old)
+            new_set = set(new)
+            removed_pairs.extend(_pairs_touching(old_set - new_set, old))
+            added_pairs.extend(_pairs_touching(new_set - old_set, new))
+        self.pair_counts.add_pairs(removed_pairs, -1)
+        self.pair_counts.add_pairs(added_pairs, 1)
+
+        old_members = {name for group in old_groups for name in group}
+        new_members = {name for group in new_groups for name in group}
+        for name in old_members - new_members:
+            self._bump(name, -1)
+        for name in new_members - old_members:
+            self._bump(name, 1)
+
+    def _bump(self, name, sign):
+        count = self.participation[name] + sign
+        if count > 0:
+            self.participation[name] = count
+        else:
+            del self.participation[name]
+
+    def rebuild(self, meetings):
+        # Fuld genopbygning fra møderne, fx til reparation eller kontrol
+        self.pair_counts.clear()
+        self.pair_counts.add_groups([group for meeting in meetings for group in meeting['groups']])
+        self.participation = Counter(
+            name for meeting in meetings for name in {n for group in meeting['groups'] for n in group})
+
+    def matches(self, meetings):
+        rebuilt = MeetingStats(PairCounts(self.pair_counts.dense_limit))
+        rebuilt.rebuild(meetings)
+        return (rebuilt.participation == self.participation
+                and _named_pairs(rebuilt.pair_counts) == _named_pairs(self.pair_counts))
+
+    def clear(self):
+        self.pair_counts.clear()
+        self.participation.clear()
+
+
+def _pairs_touching(changed, group):
+    # Alle par i gruppen, hvor mindst én af de to er blandt de ændrede medlemmer
+    pairs = []
+    for a in changed:
+        for b in group:
+            if b != a and (b not in changed or a < b):
+                pairs.append((a, b))
+    return pairs
+
+
+def _named_pairs(pair_counts):
+    names = pair_counts.names
+    return {tuple(sorted((names[a], names[b]))): count for a, b, count in pair_counts.pairs()}
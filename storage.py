@@ -0,0 +1,463 @@
+import glob
+import json
+import os
+import sqlite3
+import argparse
+from collections import Counter
+from config import DATA_FILE, JOURNAL_FILE, JOURNAL_COMPACT_BYTES, STORAGE_BACKEND, SQLITE_FILE, SNAPSHOT_FORMAT
+from journal import Journal, write_snapshot, read_snapshot
+from locking import FileLock
+from archive import MeetingArchive
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+# Det oprindelige format: ét JSON-snapshot plus en append-only log med ændringer.
+# Med snapshot_format="compact" ligger møderne i en separat fil ved siden af
+# snapshottet, som først læses, når schedulerens møder tilgås
+class JsonStorage:
+    # Statistik og eksport beregnes af scheduleren i hukommelsen
+    supports_queries = False
+
+    def __init__(self, data_file=DATA_FILE, journal_file=JOURNAL_FILE, compact_bytes=JOURNAL_COMPACT_BYTES,
+                 snapshot_format=SNAPSHOT_FORMAT):
+        if snapshot_format not in ("json", "compact"):
+            raise ValueError(f"Ukendt snapshot-format: {snapshot_format}")
+        self.data_file = data_file
+        self.journal = Journal(journal_file)
+        self.compact_bytes = compact_bytes
+        self.snapshot_format = snapshot_format
+        self.file_lock = FileLock(f"{data_file}.lock")
+        self.archive = MeetingArchive(f"{data_file}.archive")
+
+    def exists(self):
+        return os.path.exists(self.data_file) or os.path.exists(self.journal.path)
+
+    def lock(self):
+        return self.file_lock
+
+    def version(self):
+        # Ændres ved hver skrivning: nyt snapshot eller en længere log
+        return (_file_stamp(self.data_file), self.journal.size())
+
+    def replayable(self, old, new):
+        # Er der kun kommet poster til i loggen, kan de afspilles i stedet for en fuld genindlæsning
+        return old is not None and old[0] == new[0] and new[1] >= old[1]
+
+    def load_snapshot(self):
+        if not os.path.exists(self.data_file):
+            return None
+        data = read_snapshot(self.data_file)
+        if "meetings_file" in data:
+            path = os.path.join(os.path.dirname(self.data_file), data.pop("meetings_file"))
+            data["meetings_loader"] = lambda: read_snapshot(path)
+        return data
+
+    def read_journal(self):
+        return self.journal.read()
+
+    def write_snapshot(self, data, scheduler=None):
+        old_segments = set(glob.glob(f"{glob.escape(self.data_file)}.meetings-*"))
+        if self.snapshot_format == "compact":
+            # Mødefilen navngives efter snapshottets seq og skrives før selve snapshottet,
+            # så et nedbrud imellem de to aldrig parrer et gammelt snapshot med nye møder
+            meetings_path = f"{self.data_file}.meetings-{data.get('seq', 0)}"
+            write_snapshot(meetings_path, data["meetings"], compact=True)
+            data = {key: value for key, value in data.items() if key != "meetings"}
+            data["meetings_file"] = os.path.basename(meetings_path)
+            # Parhistorikken gemmes kolonnevis, hvilket er langt hurtigere at parse
+            pairs = data["pair_counts"]["pairs"]
+            data["pair_counts"] = {"names": data["pair_counts"]["names"],
+                                   "columns": [list(column) for column in zip(*pairs)] if pairs else [[], [], []]}
+            write_snapshot(self.data_file, data, compact=True)
+            old_segments.discard(meetings_path)
+        else:
+            write_snapshot(self.data_file, data)
+        # Snapshottet indeholder nu alt fra loggen
+        self.journal.truncate()
+        for path in old_segments:
+            os.remove(path)
+
+    def append(self, lines, scheduler=None):
+        self.journal.append(lines)
+
+    def needs_compaction(self):
+        return self.journal.size() > self.compact_bytes
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS participants (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE NOT NULL,
+    name TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_participants_name ON participants(name);
+CREATE TABLE IF NOT EXISTS affiliations (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS participant_affiliations (
+    participant_id TEXT NOT NULL,
+    affiliation TEXT NOT NULL,
+    PRIMARY KEY (participant_id, affiliation)
+);
+CREATE INDEX IF NOT EXISTS idx_participant_affiliations_affiliation ON participant_affiliations(affiliation);
+CREATE TABLE IF NOT EXISTS meetings (
+    serial INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    date TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_meetings_date ON meetings(date);
+CREATE INDEX IF NOT EXISTS idx_meetings_position ON meetings(position);
+CREATE TABLE IF NOT EXISTS group_members (
+    meeting_serial INTEGER NOT NULL,
+    group_index INTEGER NOT NULL,
+    member_index INTEGER NOT NULL,
+    participant_name TEXT NOT NULL,
+    PRIMARY KEY (meeting_serial, group_index, member_index)
+);
+CREATE INDEX IF NOT EXISTS idx_group_members_name ON group_members(participant_name);
+CREATE TABLE IF NOT EXISTS pair_counts (
+    name_a TEXT NOT NULL,
+    name_b TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (name_a, name_b)
+);
+CREATE INDEX IF NOT EXISTS idx_pair_counts_name_b ON pair_counts(name_b);
+"""
+
+
+# SQLite-backend med indekserede tabeller. Hver post fra schedulerens log skrives
+# igennem som opdateringer af præcis de rækker, posten berører
+class SqliteStorage:
+    # Statistik og eksport af de aktive møder kan køres som forespørgsler (se nederst)
+    supports_queries = True
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SQLITE_SCHEMA)
+        self.file_lock = FileLock(f"{path}.lock")
+        self.archive = MeetingArchive(f"{path}.archive")
+
+    def lock(self):
+        return self.file_lock
+
+    def version(self):
+        # Tælles op ved hver skrivning. seq alene ændres ikke, når et snapshot skrives
+        # uden nye poster, fx ved en migrering
+        return self._get_meta("version", 0)
+
+    def _bump_version(self):
+        self._set_meta("version", self._get_meta("version", 0) + 1)
+
+    def replayable(self, old, new):
+        # Der er ingen log at afspille; ændringer fra andre processer kræver genindlæsning
+        return False
+
+    def exists(self):
+        row = self.conn.execute("SELECT 1 FROM meta LIMIT 1").fetchone()
+        return row is not None
+
+    def _get_meta(self, key, default):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def load_snapshot(self):
+        if not self.exists():
+            return None
+        participants = [json.loads(data) for (data,) in self.conn.execute("SELECT data FROM participants ORDER BY position")]
+        names = {}
+        pairs = []
+        for name_a, name_b, count in self.conn.execute("SELECT name_a, name_b, count FROM pair_counts"):
+            a = names.setdefault(name_a, len(names))
+            b = names.setdefault(name_b, len(names))
+            pairs.append([a, b, count])
+        return {
+            "participants": participants,
+            "meetings_loader": self._load_meetings,
+            "group_affiliations": [name for (name,) in self.conn.execute("SELECT name FROM affiliations")],
+            "last_meeting_serial": self._get_meta("last_meeting_serial", 0),
+            "group_history": self._get_meta("group_history", {}),
+            "sheet_exports": self._get_meta("sheet_exports", {}),
+            "pair_counts": {"names": list(names), "pairs": pairs},
+            "participation": self._participation(),
+            "archive": self._get_meta("archive", {}),
+            "seq": self._get_meta("seq", 0),
+            "meetings_normalised": self._get_meta("meetings_normalised", False)
+        }
+
+    def _participation(self):
+        # group_members dækker kun de aktive møder; arkiverede møders deltagelse ligger i meta
+        participation = Counter(self._get_meta("archived_participation", {}))
+        participation.update(dict(self.conn.execute(
+            "SELECT participant_name, COUNT(DISTINCT meeting_serial) FROM group_members GROUP BY participant_name")))
+        return dict(participation)
+
+    def _load_meetings(self):
+        return [json.loads(data) for (data,) in self.conn.execute("SELECT data FROM meetings ORDER BY position")]
+
+    def read_journal(self):
+        # Alle ændringer er allerede skrevet direkte i tabellerne
+        return iter(())
+
+    def needs_compaction(self):
+        return False
+
+    def write_snapshot(self, data, scheduler=None):
+        with self.conn:
+            for table in ("participants", "affiliations", "participant_affiliations", "meetings", "group_members", "pair_counts"):
+                self.conn.execute(f"DELETE FROM {table}")
+            for participant in data["participants"]:
+                self._write_participant(participant)
+            self.conn.executemany("INSERT OR IGNORE INTO affiliations (name) VALUES (?)",
+                                  [(g,) for g in data["group_affiliations"]])
+            for position, meeting in enumerate(data["meetings"]):
+                self._write_meeting(meeting, position)
+            pair_names = data["pair_counts"]["names"]
+            self.conn.executemany("INSERT INTO pair_counts (name_a, name_b, count) VALUES (?, ?, ?)",
+                                  [self._pair_row(pair_names[a], pair_names[b], count)
+                                   for a, b, count in data["pair_counts"]["pairs"]])
+            self._set_meta("last_meeting_serial", data["last_meeting_serial"])
+            self._set_meta("group_history", data["group_history"])
+            self._set_meta("sheet_exports", data.get("sheet_exports", {}))
+            self._set_meta("archive", data.get("archive", {}))
+            # Deltagelse i arkiverede møder = samlet deltagelse minus de aktive møders
+            active = Counter(name for meeting in data["meetings"] for name in {n for group in meeting['groups'] for n in group})
+            self._set_meta("archived_participation", dict(Counter(data.get("participation", {})) - active))
+            self._set_meta("seq", data.get("seq", 0))
+            self._set_meta("meetings_normalised", data.get("meetings_normalised", False))
+            self._bump_version()
+
+    def append(self, lines, scheduler=None):
+        with self.conn:
+            for line in lines:
+                record = json.loads(line)
+                getattr(self, f"_write_{record['op']}")(scheduler, **record['args'])
+                self._set_meta("seq", record['seq'])
+            self._set_meta("last_meeting_serial", scheduler.last_meeting_serial)
+            self._bump_version()
+
+    def _write_participant(self, participant):
+        data = dict(participant)
+        updated = self.conn.execute("UPDATE participants SET name = ?, data = ? WHERE id = ?",
+                                    (participant.get('name'), json.dumps(data), participant['id'])).rowcount
+        if not updated:
+            self.conn.execute("INSERT INTO participants (id, name, data) VALUES (?, ?, ?)",
+                              (participant['id'], participant.get('name'), json.dumps(data)))
+        self.conn.execute("DELETE FROM participant_affiliations WHERE participant_id = ?", (participant['id'],))
+        self.conn.executemany("INSERT OR IGNORE INTO participant_affiliations (participant_id, affiliation) VALUES (?, ?)",
+                              [(participant['id'], g) for g in participant.get('groups', [])])
+        self.conn.executemany("INSERT OR IGNORE INTO affiliations (name) VALUES (?)",
+                              [(g,) for g in participant.get('groups', []) if g])
+
+    @staticmethod
+    def _pair_row(a, b, count):
+        return (a, b, count) if a < b else (b, a, count)
+
+    def _write_pair_counts(self, scheduler, groups):
+        # Skriv de aktuelle tællinger for alle par i de berørte grupper
+        rows = {}
+        for group in groups:
+            for a in group:
+                for b in group:
+                    if a < b:
+                        rows[(a, b)] = scheduler.pair_counts.get(a, b)
+        self.conn.executemany("INSERT OR REPLACE INTO pair_counts (name_a, name_b, count) VALUES (?, ?, ?)",
+                              [(a, b, count) for (a, b), count in rows.items() if count])
+        self.conn.executemany("DELETE FROM pair_counts WHERE name_a = ? AND name_b = ?",
+                              [(a, b) for (a, b), count in rows.items() if not count])
+
+    def _write_meeting(self, meeting, position=None):
+        if position is None:
+            row = self.conn.execute("SELECT position FROM meetings WHERE serial = ?", (meeting['serial'],)).fetchone()
+            if row:
+                position = row[0]
+            else:
+                position = self.conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM meetings").fetchone()[0]
+        self.conn.execute("INSERT OR REPLACE INTO meetings (serial, position, date, data) VALUES (?, ?, ?, ?)",
+                          (meeting['serial'], position, meeting.get('date'), json.dumps(meeting)))
+        self.conn.execute("DELETE FROM group_members WHERE meeting_serial = ?", (meeting['serial'],))
+        self.conn.executemany(
+            "INSERT INTO group_members (meeting_serial, group_index, member_index, participant_name) VALUES (?, ?, ?, ?)",
+            [(meeting['serial'], group_index, member_index, name)
+             for group_index, group in enumerate(meeting['groups'])
+             for member_index, name in enumerate(group)])
+
+    # En _write_<op> per post i schedulerens log. De skriver den aktuelle tilstand
+    # af de berørte rækker, så det er ligegyldigt, hvor mange poster der er samlet i en batch
+    def _write_add_group_affiliation(self, scheduler, group):
+        self.conn.execute("INSERT OR IGNORE INTO affiliations (name) VALUES (?)", (group,))
+
+    def _write_add_participant(self, scheduler, participant):
+        current = scheduler.get_participant_by_id(participant['id'])
+        if current is not None:
+            self._write_participant(current)
+
+    def _write_new_participants(self, scheduler, participants):
+        # Nye deltagere fra en synkronisering, skrevet med executemany
+        rows = [scheduler.get_participant_by_id(p['id']) for p in participants]
+        rows = [p for p in rows if p is not None]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO participants (id, name, data) VALUES (?, ?, ?)",
+            [(p['id'], p.get('name'), json.dumps(dict(p))) for p in rows])
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO participant_affiliations (participant_id, affiliation) VALUES (?, ?)",
+            [(p['id'], g) for p in rows for g in p.get('groups', [])])
+        self.conn.executemany("INSERT OR IGNORE INTO affiliations (name) VALUES (?)",
+                              [(g,) for g in {g for p in rows for g in p.get('groups', []) if g}])
+
+    def _write_update_participant(self, scheduler, participant_id, participant):
+        current = scheduler.get_participant_by_id(participant_id)
+        if current is not None:
+            self._write_participant(current)
+
+    def _write_remove_participant(self, scheduler, participant_id):
+        self.conn.execute("DELETE FROM participants WHERE id = ?", (participant_id,))
+        self.conn.execute("DELETE FROM participant_affiliations WHERE participant_id = ?", (participant_id,))
+
+    def _write_sync_participants(self, scheduler, added, updated, removed):
+        self.conn.executemany("DELETE FROM participants WHERE id = ?", [(pid,) for pid in removed])
+        self.conn.executemany("DELETE FROM participant_affiliations WHERE participant_id = ?", [(pid,) for pid in removed])
+        for participant in updated:
+            self._write_update_participant(scheduler, participant['id'], participant)
+        self._write_new_participants(scheduler, added)
+        self.conn.execute("DELETE FROM affiliations")
+        self.conn.executemany("INSERT INTO affiliations (name) VALUES (?)", [(g,) for g in scheduler.group_affiliations])
+
+    def _write_remove_all_participants(self, scheduler):
+        for table in ("participants", "participant_affiliations", "meetings", "group_members", "pair_counts"):
+            self.conn.execute(f"DELETE FROM {table}")
+        self._set_meta("archive", {})
+        self._set_meta("archived_participation", {})
+
+    def _write_create_meeting(self, scheduler, meeting):
+        current = scheduler._get_meeting_by_serial(meeting['serial'])
+        if current is not None:
+            self._write_meeting(current)
+        self._write_pair_counts(scheduler, meeting['groups'])
+
+    def _write_reset_meeting_numbers(self, scheduler):
+        self.conn.executemany("UPDATE meetings SET data = ? WHERE serial = ?",
+                              [(json.dumps(m), m['serial']) for m in scheduler.meetings])
+
+    def _write_update_meeting_date(self, scheduler, serial, date):
+        current = scheduler._get_meeting_by_serial(serial)
+        if current is not None:
+            self.conn.execute("UPDATE meetings SET date = ?, data = ? WHERE serial = ?",
+                              (current.get('date'), json.dumps(current), serial))
+
+    def _write_delete_meeting(self, scheduler, serial):
+        old_groups = self._meeting_groups(serial)
+        self.conn.execute("DELETE FROM meetings WHERE serial = ?", (serial,))
+        self.conn.execute("DELETE FROM group_members WHERE meeting_serial = ?", (serial,))
+        self._write_pair_counts(scheduler, old_groups)
+
+    def _write_update_meeting_groups(self, scheduler, serial, groups):
+        old_groups = self._meeting_groups(serial)
+        current = scheduler._get_meeting_by_serial(serial)
+        if current is not None:
+            self._write_meeting(current)
+        self._write_pair_counts(scheduler, old_groups + groups)
+
+    def _write_mark_meetings_exported(self, scheduler, versions):
+        self._set_meta("sheet_exports", scheduler.sheet_exports)
+
+    def _write_archive_meetings(self, scheduler, segments, serials):
+        # Møderne forlader tabellerne, men deres deltagelse skal stadig tælle med
+        participation = Counter(self._get_meta("archived_participation", {}))
+        for start in range(0, len(serials), 500):
+            chunk = serials[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            participation.update(dict(self.conn.execute(
+                f"SELECT participant_name, COUNT(DISTINCT meeting_serial) FROM group_members "
+                f"WHERE meeting_serial IN ({marks}) GROUP BY participant_name", chunk)))
+            self.conn.execute(f"DELETE FROM meetings WHERE serial IN ({marks})", chunk)
+            self.conn.execute(f"DELETE FROM group_members WHERE meeting_serial IN ({marks})", chunk)
+        self._set_meta("archived_participation", dict(participation))
+        self._set_meta("archive", scheduler.archived)
+
+    def _meeting_groups(self, serial):
+        groups = {}
+        for group_index, name in self.conn.execute(
+                "SELECT group_index, participant_name FROM group_members WHERE meeting_serial = ? "
+                "ORDER BY group_index, member_index", (serial,)):
+            groups.setdefault(group_index, []).append(name)
+        return list(groups.values())
+
+    # Forespørgsler, som scheduleren bruger i stedet for at gennemløbe data i Python.
+    # De svarer til tilstanden i hukommelsen, når alle poster er skrevet igennem
+    def get_participation_stats(self):
+        archived = self._get_meta("archived_participation", {})
+        return {name: count + archived.get(name, 0) for name, count in self.conn.execute(
+            "SELECT p.name, (SELECT COUNT(DISTINCT meeting_serial) FROM group_members WHERE participant_name = p.name) "
+            "FROM participants p ORDER BY p.position")}
+
+    def get_grouping_stats(self, participant_name):
+        return dict(self.conn.execute(
+            "SELECT name_b, count FROM pair_counts WHERE name_a = ? "
+            "UNION ALL SELECT name_a, count FROM pair_counts WHERE name_b = ?", (participant_name, participant_name)))
+
+    def iter_meeting_rows(self, start=None, end=None, serials=None):
+        # (serienummer, navn, dato, gruppeindeks, deltager, tilhørsgrupper) for de aktive
+        # møder. Deltagere, der ikke er på rosteren, udelades; ved dubletnavne bruges den første
+        query = (
+            "SELECT m.serial, json_extract(m.data, '$.name'), m.date, gm.group_index, gm.participant_name, "
+            "CASE WHEN json_extract(p.data, '$.groups') IS NULL THEN 'Ikke tildelt' "
+            "ELSE COALESCE((SELECT group_concat(value, ', ') FROM json_each(json_extract(p.data, '$.groups'))), '') END "
+            "FROM meetings m JOIN group_members gm ON gm.meeting_serial = m.serial "
+            "JOIN participants p ON p.position = (SELECT MIN(position) FROM participants WHERE name = gm.participant_name) "
+            "WHERE (? IS NULL OR m.date >= ?) AND (? IS NULL OR m.date <= ?) "
+            "AND (? IS NULL OR m.serial IN (SELECT value FROM json_each(?))) "
+            "ORDER BY m.position, gm.group_index, gm.member_index"
+        )
+        serials = json.dumps(sorted(int(s) for s in serials if str(s).isdigit())) if serials is not None else None
+        yield from self.conn.execute(query, (start, start, end, end, serials, serials))
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == "sqlite":
+        return SqliteStorage()
+    if backend == "json":
+        return JsonStorage()
+    raise ValueError(f"Ukendt storage-backend: {backend}")
+
+
+def migrate_storage(source, target):
+    # Indlæs fuld tilstand fra kilden (inkl. afspilning af loggen) og skriv den som ét snapshot i målet
+    from scheduler import InteractiveGroupScheduler
+    scheduler = InteractiveGroupScheduler(storage=source)
+    source.archive.copy_to(target.archive, scheduler.archived)
+    target.write_snapshot(scheduler._snapshot_state())
+    return len(scheduler.participants), len(scheduler.meetings) + scheduler.archived_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrér scheduler-data mellem JSON- og SQLite-backend")
+    parser.add_argument("direction", choices=["json-to-sqlite", "sqlite-to-json"])
+    parser.add_argument("--json-file", default=DATA_FILE)
+    parser.add_argument("--journal-file", default=JOURNAL_FILE)
+    parser.add_argument("--sqlite-file", default=SQLITE_FILE)
+    args = parser.parse_args()
+
+    json_storage = JsonStorage(args.json_file, args.journal_file)
+    sqlite_storage = SqliteStorage(args.sqlite_file)
+    if args.direction == "json-to-sqlite":
+        participants, meetings = migrate_storage(json_storage, sqlite_storage)
+    else:
+        participants, meetings = migrate_storage(sqlite_storage, json_storage)
+    print(f"Migrerede {participants} deltagere og {meetings} møder.")
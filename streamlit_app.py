@@ -1,25 +1,46 @@
+import time
+_import_started = time.perf_counter()
 import streamlit as st
 from scheduler import InteractiveGroupScheduler
 from sidebar import sidebar
 from utils import update_members_from_sheet, export_meetings_to_sheets
-from config import DATA_FILE
+from config import DATA_FILE, MEETINGS_PAGE_SIZE
+from constraints import GroupingConstraints
 import pandas as pd
 from datetime import datetime
 from collections import defaultdict
 from streamlit_gsheets import GSheetsConnection
 import io
 from utils import update_members_from_sheet, export_meetings_to_sheets, import_members_from_file
+import instrumentation
+instrumentation.record_import("streamlit_app", time.perf_counter() - _import_started)
+
+MEETING_PAGE_SIZES = sorted({5, 10, 25, 50, MEETINGS_PAGE_SIZE})
+GROUPING_TIME_BUDGETS = [1, 5, 15, 30, 60]
+# Sekunder mellem opdateringer af fremskridtet for et grupperingsforslag
+GROUPING_POLL_INTERVAL = 0.5
+
+# Én scheduler per proces, som alle sessioner deler, i stedet for en kopi af alle data per session.
+# Derfor må session_state aldrig holde schedulerens egne møde- eller gruppeobjekter: en
+# sessions ændringer ville ellers ses af alle andre og blive gemt ved næste skrivning.
+# Brug kopier (se detached_groups), og skriv kun tilbage via schedulerens metoder
+@st.cache_resource
+def get_scheduler():
+    return InteractiveGroupScheduler()
 
 def main():
     st.set_page_config(layout="wide")
 
-    if 'scheduler' not in st.session_state:
-        st.session_state.scheduler = InteractiveGroupScheduler()
-    scheduler = st.session_state.scheduler
+    scheduler = get_scheduler()
+    # Hent eventuelle ændringer skrevet af andre processer
+    scheduler.refresh()
 
     # Initialiser siden til "Hovedside", hvis den ikke allerede er sat
     if 'page' not in st.session_state:
         st.session_state.page = "Hovedside"
+    # Diagnosesiden er skjult og åbnes med ?side=diagnostik i adressen
+    if st.query_params.get("side") == "diagnostik":
+        st.session_state.page = "Diagnostik"
 
     # Tilføj navigation menu i sidebaren
     # st.sidebar.title("Navigation")
@@ -33,6 +54,8 @@ def main():
     # Skjul statistik-knappen for nu (kan gøres synlig senere)
     # if st.sidebar.button("Statistik >"):
     #     st.session_state.page = "Statistik"
+    # if st.sidebar.button("Diagnostik >"):
+    #     st.session_state.page = "Diagnostik"
     
     # Tilføj horisontal linje under sidste knap
     # st.sidebar.markdown("---")
@@ -41,12 +64,15 @@ def main():
     st.title("Gruppeinddeling")
 
     # Vis den valgte side
-    if st.session_state.page == "Hovedside":
-        main_page(scheduler)
-    elif st.session_state.page == "Statistik":
-        statistics_page(scheduler)
-    else:
-        shuffle_groups_page(scheduler)
+    with instrumentation.section(f"side.{st.session_state.page}"):
+        if st.session_state.page == "Hovedside":
+            main_page(scheduler)
+        elif st.session_state.page == "Statistik":
+            statistics_page(scheduler)
+        elif st.session_state.page == "Diagnostik":
+            diagnostics_page(scheduler)
+        else:
+            shuffle_groups_page(scheduler)
 
 def main_page(scheduler):
     sidebar(scheduler)
@@ -92,27 +118,44 @@ def main_page(scheduler):
     st.markdown('<h3 style="color:red;">STEP 4</h3>', unsafe_allow_html=True)
     st.subheader("Foreslå grupper")
     
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     with col1:
         group_size = st.selectbox("Vælg antal personer per gruppe", [3, 4, 5, 6], index=1, key="group_size_select_main")
     with col2:
         number_of_meetings = st.number_input("Antal møder at oprette", min_value=1, max_value=10, value=1, step=1, key="number_of_meetings_input")
+    with col3:
+        # Længere tid giver bedre grupper; beregningen kan altid stoppes før tid
+        time_budget = st.selectbox("Maks. beregningstid (sekunder)", GROUPING_TIME_BUDGETS, index=1, key="grouping_time_budget")
     
+    constraints = grouping_rules(scheduler)
+
     if st.button("Foreslå grupper", key="suggest_groups_button_main"):
-        all_suggested_groups = []
-        for _ in range(number_of_meetings):
-            suggested_groups, _ = scheduler.shuffle_groups(group_size)
-            if suggested_groups:
-                all_suggested_groups.append(suggested_groups)
-            else:
-                st.error(f"Der opstod en fejl under forslag af grupper for møde {len(all_suggested_groups) + 1}")
-                break
-        
-        if all_suggested_groups:
+        # Alle møder planlægges samlet, så makkerpar ikke gentages fra møde til møde.
+        # Beregningen kører i baggrunden, og resultatet samles op ved en senere rerun
+        if 'grouping_job' in st.session_state:
+            st.session_state.grouping_job.cancel()
+        st.session_state.pop('all_suggested_groups', None)
+        st.session_state.grouping_job = scheduler.start_planning(number_of_meetings, group_size, time_budget=time_budget, constraints=constraints)
+
+    job = st.session_state.get('grouping_job')
+    if job is not None and job.done:
+        del st.session_state.grouping_job
+        status = job.status()
+        all_suggested_groups = [groups for groups in status['plan'] or [] if groups]
+
+        if status['state'] != 'failed' and all_suggested_groups:
             st.session_state.all_suggested_groups = all_suggested_groups
-            st.success("Grupper er blevet foreslået. Se nedenfor for detaljer.")
+            if status['state'] == 'cancelled':
+                st.success("Beregningen blev stoppet. Det bedste forslag indtil da vises nedenfor.")
+            else:
+                st.success("Grupper er blevet foreslået. Se nedenfor for detaljer.")
+            if status['violations'] and any(status['violations']):
+                st.warning("Ikke alle regler kunne overholdes: %d par sammen trods forbud, %d par adskilt trods krav, "
+                           "%d over grænsen for virksomhed/branche." % status['violations'])
         else:
             st.error("Der opstod en fejl under forslag af grupper.")
+    elif job is not None:
+        grouping_progress()
 
     # Vis foreslåede grupper (hvis de findes)
     if 'all_suggested_groups' in st.session_state:
@@ -120,77 +163,26 @@ def main_page(scheduler):
         for meeting_index, suggested_groups in enumerate(st.session_state.all_suggested_groups):
             st.write(f"Møde {meeting_index + 1}:")
             for i, group in enumerate(suggested_groups):
-                group_str = f"Gruppe {i+1}:"
-                for name in group:
-                    participant = next((p for p in scheduler.participants if p['name'] == name), None)
-                    if participant:
-                        affiliations = ', '.join(participant.get('groups', ['Ikke tildelt']))
-                        group_str += f" {name} ({affiliations}),"
-                    else:
-                        group_str += f" {name} (Ukendt),"
-                st.write(group_str.rstrip(','))
+                st.write(scheduler.format_group(i + 1, group))
             st.write("---")
 
         st.markdown('<h3 style="color:red;">STEP 5</h3>', unsafe_allow_html=True)
         if st.button("Opret møder med disse grupper", key="create_meetings_button_main"):
-            for meeting_index, suggested_groups in enumerate(st.session_state.all_suggested_groups, 1):
-                meeting_name = scheduler.create_meeting(suggested_groups, str(meeting_date), meeting_index)
-                st.success(f"Møde '{meeting_name}' oprettet for {meeting_date} med de foreslåede grupper.")
-            scheduler.save_data()
+            with scheduler.batch():
+                for meeting_index, suggested_groups in enumerate(st.session_state.all_suggested_groups, 1):
+                    meeting_name = scheduler.create_meeting(suggested_groups, str(meeting_date), meeting_index)
+                    st.success(f"Møde '{meeting_name}' oprettet for {meeting_date} med de foreslåede grupper.")
             del st.session_state.all_suggested_groups
             st.rerun()
 
     # Vis oprettede møder
-    if scheduler.meetings:
+    if scheduler.count_meetings():
         st.header("Oprettede møder")
-        for meeting in reversed(scheduler.meetings):
-            with st.expander(f"{meeting.get('name', 'Ukendt navn')}"):
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    csv = scheduler.export_meeting_to_csv(meeting)
-                    formatted_date = datetime.strptime(meeting['date'], "%Y-%m-%d").strftime("%d-%m-%Y")
-                    st.download_button(
-                        label="Download CSV",
-                        data=csv,
-                        file_name=f"mode_{meeting.get('meeting_number', meeting['serial'])}_{formatted_date}.csv",
-                        mime="text/csv",
-                        key=f"download_meeting_{meeting['serial']}_{meeting['date']}"
-                    )
-                
-                with col2:
-                    if st.button(f"Rediger grupper", key=f"edit_{meeting['serial']}_{meeting['date']}"):
-                        st.session_state.editing_meeting = scheduler.meetings.index(meeting)
-                        st.session_state.manual_groups, st.session_state.unassigned = scheduler.manual_group_matching(
-                            [p for group in meeting['groups'] for p in group],
-                            meeting['groups']
-                        )
-                        st.rerun()
-                
-                with col3:
-                    if st.button(f"Slet møde", key=f"delete_{meeting['serial']}_{meeting['date']}"):
-                        if scheduler.delete_meeting(scheduler.meetings.index(meeting)):
-                            st.success(f"Mødet er blevet slettet.")
-                            scheduler.reset_meeting_numbers()
-                            st.rerun()
-                        else:
-                            st.error("Der opstod en fejl ved sletning af mødet.")
-                
-                st.write("Grupper:")
-                for j, group in enumerate(meeting['groups']):
-                    group_str = f"Gruppe {j+1}:"
-                    for name in group:
-                        participant = next((p for p in scheduler.participants if p['name'] == name), None)
-                        if participant:
-                            affiliations = ', '.join(participant.get('groups', ['Ikke tildelt']))
-                            group_str += f" {name} ({affiliations}),"
-                        else:
-                            group_str += f" {name} (Ukendt),"
-                    st.write(group_str.rstrip(','))
+        display_meeting_history(scheduler)
 
     # Redigeringssektion for møder
     if 'editing_meeting' in st.session_state:
-        st.subheader(f"Rediger grupper for møde {st.session_state.editing_meeting + 1}")
+        st.subheader(f"Rediger grupper for {st.session_state.editing_meeting['name']}")
         cols = st.columns(len(st.session_state.manual_groups) + 1)
         
         for i, group in enumerate(st.session_state.manual_groups):
@@ -211,12 +203,126 @@ def main_page(scheduler):
                 st.rerun()
         
         if st.button("Gem ændringer", key="save_changes_button"):
-            scheduler.update_meeting_groups(st.session_state.editing_meeting, st.session_state.manual_groups)
+            saved = scheduler.update_meeting_groups_by_serial(st.session_state.editing_meeting['serial'],
+                                                              st.session_state.manual_groups)
             del st.session_state.editing_meeting
             del st.session_state.manual_groups
             del st.session_state.unassigned
+            if not saved:
+                st.error("Mødet findes ikke længere blandt de aktive møder, så ændringerne blev ikke gemt.")
+            else:
+                st.rerun()
+
+@st.fragment(run_every=GROUPING_POLL_INTERVAL)
+def grouping_progress():
+    # Opdateres for sig selv, mens beregningen kører; når den er færdig, køres hele
+    # siden igen, så resultatet samles op i main_page
+    job = st.session_state.get('grouping_job')
+    if job is None:
+        return
+    if job.done:
+        st.rerun()
+    status = job.status()
+    st.progress(status['progress'], text=f"Beregner grupper ... {status['elapsed']:.0f} sek.")
+    if status['score'] is not None:
+        st.write(f"Bedste score indtil nu: {status['score']:.1f} (lavere er bedre)")
+    if st.button("Stop og brug bedste forslag", key="stop_grouping_button"):
+        job.cancel()
+
+def grouping_rules(scheduler):
+    # Valgfrie regler for gruppeforslaget. Returnerer None, hvis ingen regler er valgt
+    with st.expander("Regler for grupper", expanded=False):
+        names = [p['name'] for p in scheduler.participants]
+        never_together = st.multiselect("Må ikke komme i gruppe sammen", names, key="rule_never_together")
+        keep_together = st.multiselect("Skal i gruppe sammen", names, key="rule_keep_together")
+        one_per_company = st.checkbox("Højst én fra samme virksomhed per gruppe", key="rule_one_per_company")
+        one_per_industry = st.checkbox("Højst én fra samme branche per gruppe", key="rule_one_per_industry")
+    constraints = GroupingConstraints(
+        never_together=[never_together] if len(never_together) > 1 else [],
+        keep_together=[keep_together] if len(keep_together) > 1 else [],
+        max_per_company=1 if one_per_company else None,
+        max_per_industry=1 if one_per_industry else None
+    )
+    return constraints or None
+
+def display_meeting_history(scheduler):
+    # Historikken vises side for side, så en rerun kun koster det, der står på den aktuelle side
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        page_size = st.selectbox("Møder per side", MEETING_PAGE_SIZES, index=MEETING_PAGE_SIZES.index(MEETINGS_PAGE_SIZE), key="meeting_page_size")
+    with col2:
+        date_range = st.date_input("Filtrér på dato", value=(), key="meeting_date_filter")
+    start_date, end_date = (list(date_range) + [None, None])[:2] if date_range else (None, None)
+    if start_date and not end_date:
+        end_date = start_date
+
+    total = scheduler.count_meetings(start_date, end_date)
+    page_count = max(1, -(-total // page_size))
+    with col3:
+        page = st.number_input(f"Side (af {page_count})", min_value=1, max_value=page_count, value=1, step=1, key="meeting_page")
+
+    meetings = scheduler.get_meetings_page(page - 1, page_size, start_date, end_date)
+    if not meetings:
+        st.write("Ingen møder i det valgte datointerval.")
+
+    for meeting in meetings:
+        with st.expander(f"{meeting.get('name', 'Ukendt navn')}"):
+            col1, col2, col3 = st.columns(3)
+
+            with col1:
+                # CSV bygges først, når brugeren beder om den
+                csv_key = f"csv_requested_{meeting['serial']}"
+                if st.session_state.get(csv_key):
+                    formatted_date = datetime.strptime(meeting['date'], "%Y-%m-%d").strftime("%d-%m-%Y")
+                    st.download_button(
+                        label="Download CSV",
+                        data=scheduler.export_meeting_to_csv_bytes(meeting),
+                        file_name=f"mode_{meeting.get('meeting_number', meeting['serial'])}_{formatted_date}.csv",
+                        mime="text/csv",
+                        key=f"download_meeting_{meeting['serial']}_{meeting['date']}"
+                    )
+                elif st.button("Forbered CSV", key=f"prepare_csv_{meeting['serial']}_{meeting['date']}"):
+                    st.session_state[csv_key] = True
+                    st.rerun()
+
+            # Arkiverede møder kan kun ses og eksporteres
+            if scheduler.is_archived(meeting):
+                col2.caption("Arkiveret")
+            else:
+                meeting_actions(scheduler, meeting, col2, col3)
+
+            st.write("Grupper:")
+            for group_str in scheduler.render_meeting_groups(meeting):
+                st.write(group_str)
+
+def detached_groups(groups):
+    # Kopi af grupperne, som en session frit kan ændre i
+    return [list(group) for group in groups]
+
+def meeting_actions(scheduler, meeting, col2, col3):
+    with col2:
+        if st.button(f"Rediger grupper", key=f"edit_{meeting['serial']}_{meeting['date']}"):
+            # Serienummeret, ikke listeindekset: scheduleren deles af alle sessioner, og
+            # indekset kan ændre sig, før der trykkes "Gem ændringer"
+            st.session_state.editing_meeting = {'serial': meeting['serial'], 'name': meeting['name']}
+            st.session_state.manual_groups, st.session_state.unassigned = scheduler.manual_group_matching(
+                [p for group in meeting['groups'] for p in group],
+                detached_groups(meeting['groups'])
+            )
             st.rerun()
 
+    with col3:
+        if st.button(f"Slet møde", key=f"delete_{meeting['serial']}_{meeting['date']}"):
+            with scheduler.batch():
+                deleted = scheduler.delete_meeting(scheduler.meetings.index(meeting))
+                if deleted:
+                    scheduler.reset_meeting_numbers()
+            if deleted:
+                st.success(f"Mødet er blevet slettet.")
+                st.rerun()
+            else:
+                st.error("Der opstod en fejl ved sletning af mødet.")
+
 def statistics_page(scheduler):
     st.header("Statistik")
     
@@ -226,7 +332,7 @@ def statistics_page(scheduler):
         st.subheader("Antal deltagelser per person")
         participation_stats = scheduler.get_participation_stats()
         for name, count in sorted(participation_stats.items(), key=lambda x: x[1], reverse=True):
-            participant = next((p for p in scheduler.participants if p['name'] == name), None)
+            participant = scheduler.get_participant_by_name(name)
             if participant:
                 groups = ', '.join(participant.get('groups', ['Ikke tildelt']))
                 st.write(f"{name} ({groups}): {count} møde(r)")
@@ -236,17 +342,50 @@ def statistics_page(scheduler):
         participant_names = [p['name'] for p in scheduler.participants]
         selected_participant = st.selectbox("Vælg deltager", options=participant_names)
         if selected_participant:
-            participant = next((p for p in scheduler.participants if p['name'] == selected_participant), None)
+            participant = scheduler.get_participant_by_name(selected_participant)
             if participant:
                 groups = ', '.join(participant.get('groups', ['Ikke tildelt']))
                 st.write(f"Tilhørsgruppe(r): {groups}")
                 grouping_stats = scheduler.get_grouping_stats(selected_participant)
                 for other, count in sorted(grouping_stats.items(), key=lambda x: x[1], reverse=True):
-                    other_participant = next((p for p in scheduler.participants if p['name'] == other), None)
+                    other_participant = scheduler.get_participant_by_name(other)
                     if other_participant:
                         other_groups = ', '.join(other_participant.get('groups', ['Ikke tildelt']))
                         st.write(f"{other} ({other_groups}): {count} gang(e)")
 
+def diagnostics_page(scheduler):
+    st.header("Diagnostik")
+
+    # Slås til og fra for hele processen, dvs. for alle sessioner
+    enabled = st.checkbox("Tidsmåling slået til", value=instrumentation.is_enabled(), key="instrumentation_enabled")
+    if enabled != instrumentation.is_enabled():
+        instrumentation.enable(enabled)
+
+    st.write(f"Deltagere: {len(scheduler.participants)}, aktive møder: {len(scheduler.meetings)}, "
+             f"arkiverede møder: {scheduler.archived_count}, revision: {scheduler.revision}")
+
+    st.subheader("Importtider")
+    st.dataframe(pd.DataFrame([{'Modul': name, 'Sekunder': round(seconds, 3)}
+                               for name, seconds in instrumentation.imports().items()]))
+
+    st.subheader("Samlede tider")
+    summary = instrumentation.summary()
+    if summary:
+        st.dataframe(pd.DataFrame(summary, columns=['name', 'calls', 'errors', 'seconds', 'mean_seconds', 'max_seconds', 'rows', 'bytes']))
+    else:
+        st.write("Ingen målinger endnu. Slå tidsmåling til og brug appen.")
+
+    st.subheader("Seneste kald")
+    recent = instrumentation.recent(50)
+    if recent:
+        recent = pd.DataFrame(recent)
+        recent['at'] = pd.to_datetime(recent['at'], unit='s')
+        st.dataframe(recent)
+
+    if st.button("Nulstil målinger", key="reset_instrumentation_button"):
+        instrumentation.reset()
+        st.rerun()
+
 def shuffle_groups_page(scheduler):
     st.header("Shuffle Mødegrupper")
 
@@ -348,7 +487,7 @@ def shuffle_groups_page(scheduler):
                 pdf.cell(200, 10, txt=f"Gruppe {i}", ln=1)
                 for participant in group:
                     participant_name = participant if isinstance(participant, str) else participant.get('name', 'Unavngivet')
-                    participant_data = next((p for p in scheduler.participants if p['name'] == participant_name), None)
+                    participant_data = scheduler.get_participant_by_name(participant_name)
                     if participant_data:
                         pdf.cell(200, 10, txt=f"  {participant_name} - {participant_data.get('email', 'Ikke angivet')} - {participant_data.get('company', 'Ikke angivet')} - {', '.join(participant_data.get('groups', ['Ikke tildelt']))}", ln=1)
                 pdf.cell(200, 10, txt="", ln=1)  # Add an empty line between groups
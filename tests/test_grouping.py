@@ -0,0 +1,48 @@
+import random
+import pytest
+from constraints import GroupingConstraints
+from grouping import GroupingProblem, GroupScorer, plan_sequence, initial_groups, group_sizes, _random_pair
+from pairs import PairCounts
+
+
+def two_affiliation_problem(n):
+    # Kun to tilhørsgrupper, så sammenfald ikke kan undgås og søgningen aldrig når 0
+    return GroupingProblem.from_participants([{'name': f"P{i}", 'groups': [f"G{i % 2}"]} for i in range(n)])
+
+
+def test_plan_sequence_publishes_best_so_far_within_a_round():
+    calls = []
+    plan, score = plan_sequence(two_affiliation_problem(2000), 1, 4, time_budget=1.0, seed=1,
+                                on_progress=lambda progress, plan, score: calls.append((progress, plan, score)))
+
+    # Med ét møde slutter første runde ved halvdelen; der skal være resultater før da
+    early = [(progress, plan, score) for progress, plan, score in calls if progress < 0.5]
+    assert early and all(plan is not None and len(plan) == 1 for _, plan, _ in early)
+    assert [score for _, _, score in early] == sorted((score for _, _, score in early), reverse=True)
+    assert calls[-1][0] == 1.0 and calls[-1][2] == score
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_swap_delta_matches_full_cost_with_constraints(seed):
+    rng = random.Random(seed)
+    participants = [{'name': f"P{i}", 'groups': rng.sample(["A", "B", "C", "D"], rng.choice([1, 1, 2])),
+                     'company': rng.choice(["Firma 1", "Firma 2", "Firma 3", None]),
+                     'industry': rng.choice(["IT", "Finans"])} for i in range(30)]
+    history = PairCounts()
+    for _ in range(3):
+        names = [p['name'] for p in participants]
+        rng.shuffle(names)
+        history.add_groups([names[i:i + 4] for i in range(0, len(names), 4)])
+    constraints = GroupingConstraints(never_together=[["P0", "P1", "P2"], ["P3", "P4"]],
+                                      keep_together=[["P5", "P6", "P7"], ["P8", "P9"]],
+                                      max_per_company=1, max_per_industry=2)
+    problem = GroupingProblem.from_participants(participants, history, constraints)
+    scorer = GroupScorer(problem, initial_groups(len(problem), group_sizes(len(problem), 4), rng))
+
+    for _ in range(300):
+        a, b = _random_pair(scorer, rng)
+        before = scorer.cost
+        delta = scorer.swap_delta(a, b)
+        scorer.swap(a, b, delta)
+        assert scorer.cost == pytest.approx(before + delta)
+        assert scorer.cost == pytest.approx(scorer._full_cost())
@@ -0,0 +1,69 @@
+import json
+import os
+from scheduler import InteractiveGroupScheduler
+from storage import JsonStorage
+
+
+def open_scheduler(tmp_path, **options):
+    return InteractiveGroupScheduler(storage=JsonStorage(str(tmp_path / "data.json"), str(tmp_path / "data.log"), **options))
+
+
+def journal_records(tmp_path):
+    with open(tmp_path / "data.log") as f:
+        return [json.loads(line) for line in f]
+
+
+def add_people(scheduler):
+    for name in "ABCD":
+        scheduler.add_participant(name, {'name': name, 'groups': ['X']})
+
+
+def test_changes_are_journaled_and_replayed(tmp_path):
+    scheduler = open_scheduler(tmp_path)
+    snapshot = os.path.getmtime(tmp_path / "data.json"), os.path.getsize(tmp_path / "data.json")
+    add_people(scheduler)
+    scheduler.create_meeting([["A", "B"], ["C", "D"]], "2024-01-01")
+
+    # Kun loggen vokser; snapshottet skrives ikke om ved hver ændring
+    assert [record['op'] for record in journal_records(tmp_path)] == ['add_participant'] * 4 + ['create_meeting']
+    assert (os.path.getmtime(tmp_path / "data.json"), os.path.getsize(tmp_path / "data.json")) == snapshot
+
+    reloaded = open_scheduler(tmp_path)
+    assert [p['name'] for p in reloaded.participants] == list("ABCD")
+    assert [m['groups'] for m in reloaded.meetings] == [[["A", "B"], ["C", "D"]]]
+    assert reloaded.revision == 5
+    assert reloaded.verify_stats()
+
+
+def test_compaction_folds_journal_into_snapshot(tmp_path):
+    scheduler = open_scheduler(tmp_path, compact_bytes=600)
+    add_people(scheduler)
+    for week in range(1, 5):
+        scheduler.create_meeting([["A", "B"], ["C", "D"]], f"2024-01-0{week}")
+
+    # Loggen er tømt undervejs, og snapshottet har alt, hvad der var skrevet før
+    assert scheduler.storage.journal.size() <= 600
+    with open(tmp_path / "data.json") as f:
+        assert json.load(f)["seq"] > 4
+    reloaded = open_scheduler(tmp_path)
+    assert reloaded.count_meetings() == 4
+    assert reloaded.get_grouping_stats("A") == {"B": 4}
+    assert reloaded.verify_stats()
+
+
+def test_records_already_in_snapshot_are_skipped(tmp_path):
+    scheduler = open_scheduler(tmp_path)
+    add_people(scheduler)
+    scheduler.create_meeting([["A", "B"], ["C", "D"]], "2024-01-01")
+    journal = (tmp_path / "data.log").read_text()
+
+    # Nedbrud efter snapshottet, men før loggen blev ryddet: de samme poster ligger begge steder
+    scheduler.save_data()
+    (tmp_path / "data.log").write_text(journal)
+    scheduler.create_meeting([["A", "C"], ["B", "D"]], "2024-01-08")
+
+    reloaded = open_scheduler(tmp_path)
+    assert [p['name'] for p in reloaded.participants] == list("ABCD")
+    assert [m['date'] for m in reloaded.meetings] == ["2024-01-01", "2024-01-08"]
+    assert reloaded.get_grouping_stats("A") == {"B": 1, "C": 1}
+    assert reloaded.verify_stats()
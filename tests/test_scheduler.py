@@ -0,0 +1,172 @@
+import json
+import pytest
+from scheduler import InteractiveGroupScheduler
+from storage import JsonStorage, SqliteStorage
+
+
+def make_storage(kind, tmp_path):
+    if kind == "sqlite":
+        return SqliteStorage(str(tmp_path / "data.sqlite"))
+    return JsonStorage(str(tmp_path / "data.json"), str(tmp_path / "data.log"))
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage_factory(request, tmp_path):
+    return lambda: make_storage(request.param, tmp_path)
+
+
+def test_manual_edit_updates_pair_counts(storage_factory):
+    scheduler = InteractiveGroupScheduler(storage=storage_factory())
+    for name in "ABCDEF":
+        scheduler.add_participant(name, {'name': name, 'groups': ['X']})
+    scheduler.create_meeting([["A", "B", "C"], ["D", "E", "F"]], "2024-01-01")
+    meeting = scheduler.meetings[0]
+
+    # Samme forløb som redigeringen i streamlit_app: grupperne ændres på stedet
+    groups, unassigned = scheduler.manual_group_matching(
+        [p for group in meeting['groups'] for p in group], meeting['groups'])
+    groups[0].remove("C")
+    groups[1].append("C")
+    assert meeting['groups'] == [["A", "B", "C"], ["D", "E", "F"]]
+
+    assert scheduler.update_meeting_groups(0, groups)
+    assert scheduler.verify_stats()
+    assert scheduler.get_grouping_stats("C") == {"D": 1, "E": 1, "F": 1}
+
+    reloaded = InteractiveGroupScheduler(storage=storage_factory())
+    assert reloaded.verify_stats()
+    assert reloaded.get_grouping_stats("C") == {"D": 1, "E": 1, "F": 1}
+
+
+def test_legacy_snapshot_is_migrated_once(tmp_path):
+    # Ældre snapshot uden deltagelsestal og normaliserede møder
+    data_file = tmp_path / "data.json"
+    data_file.write_text(json.dumps({
+        "participants": [{"name": name, "groups": ["X"]} for name in "ABCD"],
+        "meetings": [{"serial": 1, "date": "2024-01-01", "groups": [["A", "B"], ["C", "D"]], "meeting_number": 1,
+                      "formatted_date": "01. January 2024", "name": "Møde 1 - 01. January 2024"}],
+        "group_affiliations": ["X"],
+        "last_meeting_serial": 1
+    }))
+    scheduler = InteractiveGroupScheduler(storage=JsonStorage(str(data_file), str(tmp_path / "data.log")))
+    assert scheduler.verify_stats()
+
+    reloaded = JsonStorage(str(data_file), str(tmp_path / "data.log")).load_snapshot()
+    assert "participation" in reloaded
+    assert reloaded["meetings_normalised"]
+
+
+def test_lazy_meetings_survive_compaction_by_another_process(tmp_path):
+    def open_scheduler():
+        return InteractiveGroupScheduler(storage=JsonStorage(
+            str(tmp_path / "data.json"), str(tmp_path / "data.log"), snapshot_format="compact"))
+
+    writer = open_scheduler()
+    for name in "ABCD":
+        writer.add_participant(name, {'name': name, 'groups': ['X']})
+    writer.create_meeting([["A", "B"], ["C", "D"]], "2024-01-01")
+    writer.save_data()
+
+    # Læseren har kun snapshottet; mødefilen, den peger på, fjernes af næste komprimering
+    reader = open_scheduler()
+    writer.create_meeting([["A", "C"], ["B", "D"]], "2024-01-08")
+    writer.save_data()
+
+    assert [m['date'] for m in reader.meetings] == ["2024-01-01", "2024-01-08"]
+    assert reader.verify_stats()
+
+
+def test_sqlite_version_changes_on_snapshot_only_writes(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "data.sqlite"))
+    scheduler = InteractiveGroupScheduler(storage=storage)
+    before = storage.version()
+    scheduler.save_data()
+    assert storage.version() != before
+
+
+def test_unloaded_reader_catches_up_on_compact_journal(tmp_path):
+    def open_scheduler():
+        return InteractiveGroupScheduler(storage=JsonStorage(
+            str(tmp_path / "data.json"), str(tmp_path / "data.log"), snapshot_format="compact"))
+
+    writer = open_scheduler()
+    for name in "ABCD":
+        writer.add_participant(name, {'name': name, 'groups': ['X']})
+    writer.create_meeting([["A", "B"], ["C", "D"]], "2024-01-01")
+    writer.save_data()
+
+    # Læseren har ikke indlæst sine møder, når den afspiller skriverens nye poster
+    reader = open_scheduler()
+    writer.create_meeting([["A", "C"], ["B", "D"]], "2024-01-08")
+    reader.refresh()
+
+    assert [m['date'] for m in reader.meetings] == ["2024-01-01", "2024-01-08"]
+    assert reader.verify_stats()
+
+
+def test_update_by_serial_survives_deleted_meetings(storage_factory):
+    scheduler = InteractiveGroupScheduler(storage=storage_factory())
+    for name in "ABCD":
+        scheduler.add_participant(name, {'name': name, 'groups': ['X']})
+    scheduler.create_meeting([["A", "B"], ["C", "D"]], "2024-01-01")
+    scheduler.create_meeting([["A", "C"], ["B", "D"]], "2024-01-08")
+    first, second = [meeting['serial'] for meeting in scheduler.meetings]
+
+    # En anden session sletter det første møde, mens det andet redigeres
+    scheduler.delete_meeting(0)
+    assert scheduler.update_meeting_groups_by_serial(second, [["A", "D"], ["B", "C"]])
+    assert not scheduler.update_meeting_groups_by_serial(first, [["A", "B"], ["C", "D"]])
+    assert [meeting['groups'] for meeting in scheduler.meetings] == [[["A", "D"], ["B", "C"]]]
+    assert scheduler.verify_stats()
+
+
+@pytest.mark.parametrize("kind,snapshot_format", [("json", "json"), ("json", "compact"), ("sqlite", None)])
+def test_other_process_changes_are_caught_up(tmp_path, kind, snapshot_format):
+    def open_scheduler():
+        if kind == "sqlite":
+            return InteractiveGroupScheduler(storage=SqliteStorage(str(tmp_path / "data.sqlite")))
+        return InteractiveGroupScheduler(storage=JsonStorage(
+            str(tmp_path / "data.json"), str(tmp_path / "data.log"), snapshot_format=snapshot_format))
+
+    first, second = open_scheduler(), open_scheduler()
+    for name in "ABCD":
+        first.add_participant(name, {'name': name, 'groups': ['X']})
+    first.create_meeting([["A", "B"], ["C", "D"]], "2024-01-01")
+
+    # Den anden skriver oven på den første uden at have set dens ændringer
+    second.create_meeting([["A", "C"], ["B", "D"]], "2024-01-08")
+    assert [p['name'] for p in second.participants] == list("ABCD")
+
+    # Efter et snapshot (fuld genindlæsning) og en ny post i loggen (afspilning)
+    second.save_data()
+    second.update_meeting_groups(1, [["A", "D"], ["B", "C"]])
+    first.refresh()
+    for scheduler in (first, second):
+        assert [m['date'] for m in scheduler.meetings] == ["2024-01-01", "2024-01-08"]
+        assert scheduler.meetings[1]['groups'] == [["A", "D"], ["B", "C"]]
+        assert scheduler.get_grouping_stats("A") == {"B": 1, "D": 1}
+        assert scheduler.verify_stats()
+
+
+def test_sqlite_queries_match_memory(tmp_path):
+    scheduler = InteractiveGroupScheduler(storage=SqliteStorage(str(tmp_path / "data.sqlite")))
+    for name in "ABCDEF":
+        scheduler.add_participant(name, {'name': name, 'groups': ['X', 'Y'] if name < "C" else ['Z']})
+    scheduler.create_meeting([["A", "B", "C"], ["D", "E", "F"]], "2020-01-06")
+    scheduler.create_meeting([["A", "D"], ["B", "E"], ["C", "F"]], "2024-01-01")
+    scheduler.create_meeting([["A", "E"], ["B", "F"], ["C", "D"]], "2024-01-08")
+    scheduler.update_meeting_groups(2, [["A", "F"], ["B", "E"], ["C", "D"]])
+    scheduler.archive_meetings("2021-01-01")
+    scheduler.remove_participant(scheduler.get_participant_by_name("F")['id'])
+    assert scheduler._queries() is scheduler.storage
+
+    def answers():
+        return (scheduler.get_participation_stats(),
+                {name: scheduler.get_grouping_stats(name) for name in "ABCDEF"},
+                list(scheduler.iter_meeting_rows()),
+                list(scheduler.iter_meeting_rows(start_date="2024-01-02")),
+                list(scheduler.iter_meeting_rows(serials=["1", "3"])))
+
+    from_queries = answers()
+    scheduler._queries = lambda: None
+    assert from_queries == answers()
@@ -0,0 +1,74 @@
+import pandas as pd
+from scheduler import InteractiveGroupScheduler
+from storage import JsonStorage
+from sheets import LocalSheetsConnection
+from utils import sync_roster, export_meetings_to_sheets, update_members_from_sheet
+
+
+def roster(rows):
+    return pd.DataFrame(rows, columns=["Navn", "Gruppe", "Email", "Virksomhed"])
+
+
+def test_sync_roster_reports_changes(tmp_path):
+    scheduler = InteractiveGroupScheduler(storage=JsonStorage(str(tmp_path / "data.json"), str(tmp_path / "data.log")))
+    report = sync_roster(scheduler, roster([
+        ["Anna", "X", "anna@example.com", "A/S"],
+        ["Bo", "X", "bo@example.com", "A/S"],
+        ["Carl", "Y", "carl@example.com", "ApS"],
+    ]))
+    assert (report['added'], report['updated'], report['removed'], report['unchanged']) == (3, 0, 0, 0)
+    ids = {p['name']: p['id'] for p in scheduler.participants}
+
+    # Bo skifter virksomhed, Carl er væk, Dorte er ny, og Annas række står to gange
+    report = sync_roster(scheduler, roster([
+        ["Anna", "X", "anna@example.com", "A/S"],
+        ["Bo", "X", "bo@example.com", "I/S"],
+        ["Dorte", "Y", "dorte@example.com", "ApS"],
+        ["Anna igen", "X", "anna@example.com", "A/S"],
+    ]))
+    assert (report['added'], report['updated'], report['removed'], report['unchanged']) == (1, 1, 1, 1)
+    assert list(report['errors']['Række']) == [5]
+
+    assert [p['name'] for p in scheduler.participants] == ["Anna", "Bo", "Dorte"]
+    assert scheduler.get_participant_by_name("Bo")['company'] == "I/S"
+    assert scheduler.get_participant_by_id(ids["Bo"]) is scheduler.get_participant_by_name("Bo")
+    assert scheduler.get_participant_by_name("Carl") is None
+    assert scheduler.group_affiliations == {"X", "Y"}
+
+    # Samme liste igen ændrer intet
+    report = sync_roster(scheduler, roster([
+        ["Anna", "X", "anna@example.com", "A/S"],
+        ["Bo", "X", "bo@example.com", "I/S"],
+        ["Dorte", "Y", "dorte@example.com", "ApS"],
+    ]))
+    assert (report['added'], report['updated'], report['removed'], report['unchanged']) == (0, 0, 0, 3)
+
+
+def test_export_to_sheets_keeps_history_when_roster_changes(tmp_path):
+    scheduler = InteractiveGroupScheduler(storage=JsonStorage(str(tmp_path / "data.json"), str(tmp_path / "data.log")))
+    for name in "ABCDEF":
+        scheduler.add_participant(name, {'name': name, 'groups': ['X']})
+    scheduler.create_meeting([["A", "B", "C"], ["D", "E", "F"]], "2024-01-01")
+    scheduler.create_meeting([["A", "D"], ["B", "E"], ["C", "F"]], "2024-01-08")
+    sheets = LocalSheetsConnection(str(tmp_path / "ark"))
+
+    assert export_meetings_to_sheets(scheduler, sheets)[1].startswith("Eksporterede 2 nye og 0 ændrede")
+
+    # F forlader foreningen; de gamle møder er uændrede og skal blive liggende i arket
+    scheduler.remove_participant(scheduler.get_participant_by_name("F")['id'])
+    assert export_meetings_to_sheets(scheduler, sheets) == (True, "Ingen nye møder at eksportere.")
+    assert list(sheets.read("Mødedata")['Deltager']).count("F") == 2
+
+    scheduler.update_meeting_groups(1, [["A", "E"], ["B", "D"]])
+    assert export_meetings_to_sheets(scheduler, sheets)[1].startswith("Eksporterede 0 nye og 1 ændrede")
+
+
+def test_update_members_from_plain_local_sheet(tmp_path):
+    scheduler = InteractiveGroupScheduler(storage=JsonStorage(str(tmp_path / "data.json"), str(tmp_path / "data.log")))
+    sheets = LocalSheetsConnection(str(tmp_path / "ark"))
+    sheets.update(None, roster([["Anna", "X", "anna@example.com", "A/S"], ["Bo", "Y", "bo@example.com", "ApS"]]))
+
+    success, message = update_members_from_sheet(scheduler, sheets, log=lambda message: None)
+    assert success and message.startswith("Tilføjede 2")
+    assert update_members_from_sheet(scheduler, sheets, log=lambda message: None) == (
+        True, "Medlemsarket er uændret siden sidste import.")
@@ -1,103 +1,229 @@
 import pandas as pd
-import streamlit as st
-from streamlit_gsheets import GSheetsConnection
 from datetime import datetime
 import uuid
+from collections import defaultdict
+from itertools import groupby
+import hashlib
+import json
+from sheets import get_sheets_connection, cached_reader
+from config import MEMBER_KEY_COLUMN
+from instrumentation import timed, note
 
-def update_members_from_sheet(scheduler):
-    st.write("Starter import proces...")
-    
-    # Ryd alle eksisterende medlemmer
-    scheduler.participants.clear()
-    scheduler.group_affiliations.clear()
-    st.write("Alle eksisterende medlemmer og gruppetilhør er fjernet.")
-    
-    # Genindlæs data fra Google Sheets
-    conn = st.connection("gsheets", type=GSheetsConnection)
-    df = conn.read()
-    st.write(f"Data indlæst fra Google Sheets. Antal rækker: {len(df)}")
+ROSTER_COLUMNS = {
+    "Email": "email",
+    "Virksomhed": "company",
+    "Stilling": "position",
+    "Branche": "industry"
+}
 
-    added_count = 0
-    errors = []
+def _clean_text_column(df, column):
+    # Strip og null-håndtering for en hel kolonne på én gang. Manglende kolonner giver tomme strenge
+    if column not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    values = df[column]
+    return values.astype(str).str.strip().where(values.notna(), "")
 
-    for index, row in df.iterrows():
-        try:
-            full_name = str(row['Navn']).strip() if pd.notnull(row['Navn']) else None
-            if not full_name:
-                errors.append(f"Række {index + 2} i Google Sheet har ikke et gyldigt navn.")
+def normalise_roster(df):
+    # Normaliser Navn/Gruppe/Email/Virksomhed/Stilling/Branche kolonnevis og returnér
+    # (medlemmer, fejl) som to DataFrames
+    df = df.reset_index(drop=True)
+    row_numbers = df.index + 2  # Rækkenummer i arket inkl. overskriftsrækken
+
+    if 'Navn' not in df.columns:
+        raise KeyError('Navn')
+    names = _clean_text_column(df, 'Navn')
+    valid = names != ""
+    errors = pd.DataFrame({
+        'Række': row_numbers[~valid],
+        'Fejl': "Rækken har ikke et gyldigt navn."
+    })
+
+    raw_groups = df['Gruppe']
+    parts = raw_groups[raw_groups.notna() & valid].astype(str).str.split(',').explode().str.strip()
+    parts = parts[parts.notna() & (parts != "")]
+    split_groups = defaultdict(list)
+    for index, group in zip(parts.index, parts.values):
+        split_groups[index].append(group)
+    groups = [
+        split_groups.get(index, []) if present else ['Ikke tildelt']
+        for index, present in zip(df.index, raw_groups.notna())
+    ]
+
+    members = pd.DataFrame({'name': names, 'groups': groups})
+    for column, key in ROSTER_COLUMNS.items():
+        members[key] = _clean_text_column(df, column)
+    members = members[valid]
+    members.index = row_numbers[valid]
+    return members, errors
+
+MEMBER_FIELDS = ['name', 'groups'] + list(ROSTER_COLUMNS.values())
+
+def _member_key(record, key_field):
+    value = str(record.get(key_field) or "").strip().lower()
+    return value or "navn:" + str(record.get('name', '')).strip().lower()
+
+def _member_fingerprint(record):
+    # Sammenligningsnøgle for en række: ens fingeraftryk betyder uændret medlem
+    return (record.get('name', ""), tuple(record.get('groups', ())),
+            *[record.get(field, "") for field in ROSTER_COLUMNS.values()])
+
+@timed("utils.sync_roster")
+def sync_roster(scheduler, df, key_column=MEMBER_KEY_COLUMN):
+    # Upsert-synkronisering af rosteren: rækker matches med eksisterende deltagere på
+    # nøglekolonnen, og kun nye, ændrede og forsvundne medlemmer skrives. Returnerer
+    # en rapport med antal tilføjede, opdaterede, fjernede og uændrede samt fejl
+    key_field = {'Navn': 'name', **ROSTER_COLUMNS}[key_column]
+    note(rows=len(df))
+    members, errors = normalise_roster(df)
+
+    # Diff og ændringer under samme lås, så en anden skriver ikke kan nå ind imellem
+    with scheduler.batch():
+        existing = {}
+        stale = []  # Eksisterende dubletter på nøglen fjernes, så kun én deltager er tilbage
+        for participant in scheduler.participants:
+            key = _member_key(participant, key_field)
+            if key in existing:
+                stale.append(participant['id'])
+            else:
+                existing[key] = participant
+
+        added, updated, duplicates = [], [], []
+        seen = set()
+        unchanged = 0
+        columns = [members[field].tolist() for field in MEMBER_FIELDS]
+        for row_number, values in zip(members.index.tolist(), zip(*columns)):
+            record = dict(zip(MEMBER_FIELDS, values))
+            key = _member_key(record, key_field)
+            if key in seen:
+                duplicates.append(row_number)
                 continue
-            
-            groups = [g.strip() for g in str(row['Gruppe']).split(',') if g.strip()] if pd.notnull(row['Gruppe']) else ['Ikke tildelt']
-            
-            member_data = {
-                "name": full_name,
-                "groups": groups,
-                "email": str(row['Email']).strip() if pd.notnull(row.get('Email')) else "",
-                "company": str(row['Virksomhed']).strip() if pd.notnull(row.get('Virksomhed')) else "",
-                "position": str(row['Stilling']).strip() if pd.notnull(row.get('Stilling')) else "",
-                "industry": str(row['Branche']).strip() if pd.notnull(row.get('Branche')) else ""
-            }
-            
-            scheduler.add_participant(full_name, member_data)
-            added_count += 1
-            
-            for group in groups:
-                scheduler.add_group_affiliation(group)
-        
-        except Exception as e:
-            errors.append(f"Fejl ved behandling af række {index + 2}: {str(e)}")
+            seen.add(key)
+            current = existing.get(key)
+            if current is None:
+                added.append(record)
+            elif _member_fingerprint(current) != _member_fingerprint(record):
+                updated.append({**current, **record})
+            else:
+                unchanged += 1
+        removed = stale + [p['id'] for key, p in existing.items() if key not in seen]
 
-    st.write(f"Antal medlemmer efter import: {len(scheduler.participants)}")
-    
-    scheduler.save_data()
+        scheduler.sync_participants(added, updated, removed)
 
-    status_message = f"Tilføjede {added_count} medlemmer."
-    if errors:
-        status_message += f" Der opstod {len(errors)} fejl under opdateringen."
-    
-    return True, status_message
+    if duplicates:
+        errors = pd.concat([errors, pd.DataFrame({
+            'Række': duplicates,
+            'Fejl': f"Rækken har samme {key_column} som en tidligere række og er sprunget over."
+        })], ignore_index=True)
+    return {
+        'added': len(added),
+        'updated': len(updated),
+        'removed': len(removed),
+        'unchanged': unchanged,
+        'errors': errors
+    }
 
-def export_meetings_to_sheets(scheduler):
-    conn = st.connection("gsheets", type=GSheetsConnection)
-    
-    # Læs eksisterende data
-    existing_data = conn.read(worksheet="Mødedata")
-    
-    # Konverter scheduler.meetings til en dataframe
-    new_meetings = scheduler.export_meetings_to_dataframe()
-    
-    # Check om 'Møde-ID' eller 'serial' kolonnen eksisterer
-    id_column = 'Møde-ID' if 'Møde-ID' in new_meetings.columns else 'serial'
-    
-    if id_column not in new_meetings.columns:
-        return False, "Fejl: Kunne ikke finde møde-id kolonne i dataen."
-    
-    # Håndter eksisterende ID'er mere sikkert
-    if id_column in existing_data.columns:
-        existing_ids = set(existing_data[id_column].dropna().astype(str).tolist())
+def _sync_message(report):
+    message = (f"Tilføjede {report['added']}, opdaterede {report['updated']} og fjernede "
+               f"{report['removed']} medlemmer ({report['unchanged']} uændrede).")
+    if not report['errors'].empty:
+        message += f" Der opstod {len(report['errors'])} fejl under opdateringen."
+    return message
+
+def _streamlit_write(message):
+    # Streamlit importeres først, når der skal skrives til siden
+    import streamlit as st
+    if isinstance(message, pd.DataFrame):
+        st.dataframe(message)
     else:
-        existing_ids = set()
-    
-    # Konverter nye møde-ID'er til strenge for sammenligning
-    new_meetings[id_column] = new_meetings[id_column].astype(str)
-    
-    # Filtrer nye møder, der ikke allerede er i sheetet
-    new_meetings = new_meetings[~new_meetings[id_column].isin(existing_ids)]
+        st.write(message)
+
+@timed("utils.update_members_from_sheet")
+def update_members_from_sheet(scheduler, sheets=None, log=_streamlit_write):
+    # 'log' modtager statusbeskeder og fejltabellen; fra kommandolinjen fx print
+    log("Starter import proces...")
     
-    if new_meetings.empty:
+    # Læs medlemsarket gennem den fælles cache. En rå forbindelse (fx LocalSheetsConnection)
+    # pakkes ind, så den også kan give et fingeraftryk
+    sheets = cached_reader(sheets) or get_sheets_connection()
+    df, fingerprint = sheets.read_with_fingerprint()
+    log(f"Data indlæst fra Google Sheets. Antal rækker: {len(df)}")
+
+    # Er hverken arket eller rosteren ændret siden sidste synkronisering, er der intet at gøre
+    if scheduler.last_member_sync == (fingerprint, scheduler.revision):
+        return True, "Medlemsarket er uændret siden sidste import."
+
+    # Kun ændringer i forhold til den nuværende roster skrives
+    report = sync_roster(scheduler, df)
+    scheduler.last_member_sync = (fingerprint, scheduler.revision)
+
+    log(f"Antal medlemmer efter import: {len(scheduler.participants)}")
+    if not report['errors'].empty:
+        log(report['errors'])
+
+    return True, _sync_message(report)
+
+def _meeting_version(meeting):
+    # Hash af mødets eget indhold. Rosteren indgår ikke, så et medlem, der senere fjernes
+    # eller skifter tilhørsgruppe, ikke får alle gamle møder til at se ændrede ud
+    text = json.dumps([meeting.get('serial'), meeting.get('name', ''), str(meeting['date']), meeting['groups']],
+                      ensure_ascii=False)
+    return "m:" + hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _rows_version(rows):
+    # Den tidligere version: hash af mødets eksporterede rækker
+    text = json.dumps([list(row.values()) for row in rows], default=str, ensure_ascii=False)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+@timed("utils.export_meetings_to_sheets")
+def export_meetings_to_sheets(scheduler, sheets=None, worksheet="Mødedata"):
+    # Delta-eksport: kun møder, der er nye eller ændret siden sidste eksport, sendes.
+    # Nye møder tilføjes nederst i arket, ændrede møder får deres gamle rækker slettet
+    # og de nye tilføjet. 'sheets' kan fx være en LocalSheetsConnection
+    sheets = sheets or get_sheets_connection()
+    id_column = 'Møde-ID'
+
+    exported = scheduler.sheet_exports
+    if not exported:
+        # Første delta-eksport: møder, der allerede ligger i arket fra en tidligere
+        # fuld eksport, behandles som ændrede, så de ikke dubleres
+        try:
+            exported = {str(key): None for key in sheets.key_values(worksheet, id_column) if key != ""}
+        except Exception as e:
+            return False, f"Der opstod en fejl under læsning af Google Sheets: {str(e)}"
+
+    pending = {}
+    for meeting in scheduler.iter_all_meetings():
+        version = _meeting_version(meeting)
+        if exported.get(str(meeting.get('serial', '')), "") != version:
+            pending[str(meeting.get('serial', ''))] = version
+    # Møder eksporteret med den tidligere version sammenlignes på rækkerne én gang og får
+    # derefter den nye version uden at blive sendt igen, hvis de er uændrede
+    legacy = {serial for serial in pending if exported.get(serial) and not exported[serial].startswith("m:")}
+    if legacy:
+        unchanged = {}
+        for serial, rows in groupby(scheduler.iter_meeting_rows(serials=legacy), key=lambda row: row[id_column]):
+            if _rows_version(list(rows)) == exported[serial]:
+                unchanged[serial] = pending.pop(serial)
+        if unchanged:
+            scheduler.mark_meetings_exported(unchanged)
+
+    if not pending:
         return True, "Ingen nye møder at eksportere."
-    
+
+    changed = [serial for serial in pending if serial in exported]
     try:
-        # Tilføj nye møder til eksisterende data
-        updated_data = pd.concat([existing_data, new_meetings], ignore_index=True)
-        
-        # Opdater Google Sheet
-        conn.update(data=updated_data, worksheet="Mødedata")
-        
-        return True, f"Eksporterede {len(new_meetings)} nye møder til Google Sheets."
+        if changed:
+            sheets.delete_rows_where(worksheet, id_column, changed)
+        data = pd.DataFrame(list(scheduler.iter_meeting_rows(serials=pending)), columns=scheduler.MEETING_EXPORT_COLUMNS)
+        sheets.append_rows(worksheet, data)
+        note(rows=len(data))
     except Exception as e:
         return False, f"Der opstod en fejl under eksport af data: {str(e)}"
 
+    scheduler.mark_meetings_exported(pending)
+    added = len(pending) - len(changed)
+    return True, f"Eksporterede {added} nye og {len(changed)} ændrede møder til Google Sheets."
+
 # Helper function to convert DataFrame to dict for JSON serialization
 def df_to_dict(df):
     return df.to_dict(orient='records')
@@ -106,6 +232,7 @@ def df_to_dict(df):
 def dict_to_df(data):
     return pd.DataFrame(data)
 
+@timed("utils.import_members_from_file")
 def import_members_from_file(scheduler, file):
     if file is not None:
         try:
@@ -116,34 +243,10 @@ def import_members_from_file(scheduler, file):
             else:
                 return False, "Ugyldigt filformat. Brug venligst CSV eller Excel."
             
-            # Ryd eksisterende data
-            scheduler.participants.clear()
-            scheduler.group_affiliations.clear()
-            
-            # Importer data fra filen
-            for index, row in df.iterrows():
-                full_name = str(row['Navn']).strip() if pd.notnull(row['Navn']) else None
-                if not full_name:
-                    continue
-                
-                groups = [g.strip() for g in str(row['Gruppe']).split(',') if g.strip()] if pd.notnull(row['Gruppe']) else ['Ikke tildelt']
-                
-                member_data = {
-                    "name": full_name,
-                    "groups": groups,
-                    "email": str(row['Email']).strip() if pd.notnull(row.get('Email')) else "",
-                    "company": str(row['Virksomhed']).strip() if pd.notnull(row.get('Virksomhed')) else "",
-                    "position": str(row['Stilling']).strip() if pd.notnull(row.get('Stilling')) else "",
-                    "industry": str(row['Branche']).strip() if pd.notnull(row.get('Branche')) else ""
-                }
-                
-                scheduler.add_participant(full_name, member_data)
-                
-                for group in groups:
-                    scheduler.add_group_affiliation(group)
-            
-            scheduler.save_data()
-            return True, f"Importerede {len(scheduler.participants)} medlemmer fra filen."
+            # Synkroniser rosteren med filen, så uændrede medlemmer beholder deres id
+            report = sync_roster(scheduler, df)
+
+            return True, _sync_message(report)
         except Exception as e:
             return False, f"Fejl under import af fil: {str(e)}"
     else: